@@ -173,6 +173,8 @@ def _get_globals(config_variables):
     # This is needed for the ceph_osd_stats check, which iterates over
     # host IDs. Give it a fake list to be happy.
     new_globals["ceph_osd_host"] = {'osd_ids': ["id"]}
+    # The ceph_osds_stats check iterates over the OSD IDs of the host.
+    new_globals["ceph_osd_list"] = ["id"]
 
     # The following names are needed during partial template rendering
     # so we can at least create the proper alarms per check, since the
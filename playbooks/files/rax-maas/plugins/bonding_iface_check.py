@@ -16,57 +16,96 @@
 
 import argparse
 import os
-import subprocess
 
+from maas_common import MAX_METRICS
 from maas_common import metric
 from maas_common import metric_bool
+from maas_common import metric_delta
 from maas_common import print_output
 
 
-def bonding_ifaces_check(_):
-    bonding_ifaces = os.listdir("/proc/net/bonding")
-    for bonding_iface in bonding_ifaces:
-        bonding_iface_check_cmd = ['cat', '/proc/net/bonding/%s'
-                                   % bonding_iface]
-        bonding_iface_check_cmd_output = subprocess.check_output(
-            bonding_iface_check_cmd
-        )
-
-        bonding_iface_check_cmd_output_lines = (
-            bonding_iface_check_cmd_output.decode().split('\n')
-        )
-
-        slave_count = 0
-        failure_count = 0
-        for idx, line in enumerate(bonding_iface_check_cmd_output_lines):
-            if line.startswith("Slave Interface"):
-                slave_count = slave_count + 1
-
-        has_slave_down = False
-        for idx, line in enumerate(bonding_iface_check_cmd_output_lines):
-            if line.startswith("Slave Interface"):
-                slave_inface_mii_status_line = (
-                    bonding_iface_check_cmd_output_lines[idx + 1]
-                )
-                slave_inface_mii_status = (
-                    slave_inface_mii_status_line.split(":")[1].strip()
-                )
-                if 'up' not in slave_inface_mii_status or slave_count < 2:
-                    has_slave_down = True
-
-            if line.startswith("Link Failure Count"):
-                failure_count =+ int(line.split(':')[1])
-
-        if has_slave_down:
-            metric_bool('host_bonding_iface_%s_slave_down' %
-                        bonding_iface,
-                        True)
+BONDING_DIR = '/proc/net/bonding'
+
+
+def parse_bond(text):
+    """Parse the /proc/net/bonding file of a bond into a record.
+
+    The lines before the first "Slave Interface" describe the bond, each
+    following block one slave. Only the first occurrence of a key is kept
+    in each section, 802.3ad details repeat some of them.
+    """
+    bond = {'mode': None, 'active_slave': None, 'mii_status': None,
+            'slaves': []}
+    section = dict()
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if not sep:
+            continue
+        key = key.strip()
+        value = value.strip()
+        if key == 'Slave Interface':
+            section = {'name': value}
+            bond['slaves'].append(section)
         else:
-            metric_bool('host_bonding_iface_%s_slave_down' %
-                        bonding_iface,
-                        False)
+            section.setdefault(key, value)
+        if not bond['slaves']:
+            if key == 'Bonding Mode':
+                bond['mode'] = value
+            elif key == 'Currently Active Slave':
+                bond['active_slave'] = value
+            elif key == 'MII Status':
+                bond['mii_status'] = value
+
+    slaves = []
+    for section in bond['slaves']:
+        slaves.append({
+            'name': section['name'],
+            'mii_status': section.get('MII Status'),
+            'speed': section.get('Speed'),
+            'duplex': section.get('Duplex'),
+            'link_failure_count': int(section.get('Link Failure Count', 0))
+        })
+    bond['slaves'] = slaves
+    return bond
+
+
+def read_bonds(path=BONDING_DIR):
+    bonds = dict()
+    for bonding_iface in sorted(os.listdir(path)):
+        with open(os.path.join(path, bonding_iface)) as f:
+            bonds[bonding_iface] = parse_bond(f.read())
+    return bonds
+
+
+def bonding_ifaces_check(_):
+    bonds = read_bonds()
+    # The active slave and the failures of each slave since the previous
+    # run are only reported when they fit with the metrics of every bond.
+    extended = sum(3 + len(b['slaves']) for b in bonds.values())
+    extended = extended <= MAX_METRICS
+
+    for bonding_iface, bond in bonds.items():
+        slaves = bond['slaves']
+        slave_down = any('up' not in (s['mii_status'] or '')
+                         for s in slaves)
+        has_slave_down = len(slaves) < 2 or slave_down
+        metric_bool('host_bonding_iface_%s_slave_down' % bonding_iface,
+                    has_slave_down)
+
+        failure_count = sum(s['link_failure_count'] for s in slaves)
+        metric('host_bonding_iface_%s_failure_count' % bonding_iface,
+               'int64', failure_count)
+
+        if not extended:
+            continue
+        if bond['active_slave']:
+            metric('host_bonding_iface_%s_active_slave' % bonding_iface,
+                   'string', bond['active_slave'])
+        for slave in slaves:
+            metric_delta('host_bonding_iface_%s_%s_failures'
+                         % (bonding_iface, slave['name']),
+                         'int64', slave['link_failure_count'], 'failures')
 
-        metric('host_bonding_iface_%s_failure_count' % bonding_iface, 'int64', failure_count)
 
 def main(args):
     bonding_ifaces_check(args)
@@ -15,17 +15,37 @@
 # limitations under the License.
 
 import argparse
+import glob
 import json
+import os
+import socket
+import struct
+
+try:
+    import rados
+    rados_module_active = True
+except ImportError:
+    rados_module_active = False
+from maas_common import find_container
+from maas_common import get_cached
 from maas_common import metric_bool
 from maas_common import metric
 from maas_common import MaaSException
 from maas_common import status_ok
 from maas_common import print_output
+from maas_common import running_containers
 import requests
 import subprocess
 
 
 STATUSES = {'HEALTH_OK': 2, 'HEALTH_WARN': 1, 'HEALTH_ERR': 0}
+# The cluster, mon and health_checks subcommands all read "ceph status",
+# share a single snapshot of it between them for this many seconds.
+STATUS_CACHE_TTL = 30
+# Admin sockets are bind mounted from the containers into this directory,
+# either directly or in a sub directory named after the cluster fsid.
+ADMIN_SOCKET_DIR = '/run/ceph'
+ADMIN_SOCKET_TIMEOUT = 10
 IGNORE_CHECKS = ['OSDMAP_FLAGS', 'OBJECT_MISPLACED']
 
 # See https://docs.ceph.com/docs/master/rados/operations/health-checks
@@ -117,9 +137,16 @@ DETAILED_CHECKS = {
 
 def check_command(command, container_name=None, deploy_osp=False):
     if container_name:
+        # Use the runtime the container was found in, or the one expected
+        # for the deployment when it was not found
+        container = running_containers().get(container_name)
+        if container:
+            runtime = container.runtime
+        else:
+            runtime = 'podman' if deploy_osp else 'lxc'
 
-        if deploy_osp:
-            container_command = ['/usr/bin/podman',
+        if runtime != 'lxc':
+            container_command = ['/usr/bin/%s' % runtime,
                                  'exec',
                                  container_name]
 
@@ -139,6 +166,60 @@ def check_command(command, container_name=None, deploy_osp=False):
     return json.loads(lines[-1])
 
 
+def _recv_exactly(sock, length):
+    data = b''
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise IOError('Admin socket closed the connection')
+        data += chunk
+    return data
+
+
+def admin_socket_command(path, prefix, timeout=ADMIN_SOCKET_TIMEOUT):
+    """Run a command against a ceph daemon admin socket.
+
+    This is what "ceph daemon <socket> <prefix>" does, without starting a
+    ceph client inside the container. The command is sent as JSON ending
+    with a NUL byte, the reply is a 32 bit big endian length followed by
+    the JSON output.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    with sock:
+        sock.connect(path)
+        command = json.dumps({'prefix': prefix, 'format': 'json'})
+        sock.sendall(command.encode() + b'\0')
+        length = struct.unpack('>I', _recv_exactly(sock, 4))[0]
+        return json.loads(_recv_exactly(sock, length).decode())
+
+
+def rados_mon_command(client, keyring, prefix):
+    """Run a mon command through librados instead of the ceph CLI."""
+    cluster = rados.Rados(name=client,
+                          conffile='/etc/ceph/ceph.conf',
+                          conf={'keyring': keyring})
+    cluster.connect(timeout=ADMIN_SOCKET_TIMEOUT)
+    try:
+        ret, output, error = cluster.mon_command(
+            json.dumps({'prefix': prefix, 'format': 'json'}), b'')
+    finally:
+        cluster.shutdown()
+    if ret != 0:
+        raise MaaSException('ceph %s failed: %s' % (prefix, error))
+    return json.loads(output.decode())
+
+
+def find_osd_admin_sockets(socket_dir=ADMIN_SOCKET_DIR):
+    """Return {osd_id: admin socket path} for the OSDs on this host."""
+    sockets = dict()
+    for pattern in ('ceph-osd.*.asok', '*/ceph-osd.*.asok'):
+        for path in glob.glob(os.path.join(socket_dir, pattern)):
+            osd_id = os.path.basename(path)[len('ceph-osd.'):-len('.asok')]
+            sockets[osd_id] = path
+    return sockets
+
+
 def get_ceph_rgw_hostcheck(rgw_address, container_name=None):
     try:
         sc = requests.get(rgw_address, verify=False).status_code
@@ -152,11 +233,27 @@ def get_ceph_rgw_hostcheck(rgw_address, container_name=None):
 
 
 def get_ceph_status(client, keyring, fmt='json', container_name=None,
-                    deploy_osp=False):
-
-    return check_command(('ceph', '--format', fmt, 'status'),
-                         container_name=container_name,
-                         deploy_osp=deploy_osp)
+                    deploy_osp=False, status_ttl=STATUS_CACHE_TTL,
+                    librados=False):
+    if librados:
+        if not rados_module_active:
+            raise MaaSException('librados was requested but the rados '
+                                'module is not installed within the plugin '
+                                'execution path.')
+        cache_name = '_'.join(('ceph_status', 'rados', str(client),
+                               str(keyring)))
+        return get_cached(cache_name, status_ttl, rados_mon_command,
+                          client, keyring, 'status')
+
+    cache_name = '_'.join(('ceph_status',
+                           container_name or 'host',
+                           'podman' if deploy_osp else 'lxc',
+                           str(client),
+                           str(keyring)))
+    return get_cached(cache_name, status_ttl, check_command,
+                      ('ceph', '--format', fmt, 'status'),
+                      container_name=container_name,
+                      deploy_osp=deploy_osp)
 
 
 def get_ceph_mon_status(client, keyring, fmt='json', container_name=None,
@@ -169,6 +266,10 @@ def get_ceph_mon_status(client, keyring, fmt='json', container_name=None,
 
 def get_local_osd_info(osd_ref, fmt='json', container_name=None,
                        admin_socket=None, deploy_osp=False):
+    # Talk to the socket directly when it is bind mounted on the host
+    if admin_socket and os.path.exists(admin_socket):
+        return admin_socket_command(admin_socket, 'status')
+
     return check_command(
         ('ceph', '--format', fmt, 'daemon', osd_ref, 'status') if
         not admin_socket else
@@ -180,11 +281,14 @@ def get_local_osd_info(osd_ref, fmt='json', container_name=None,
 
 def get_mon_statistics(client=None, keyring=None, host=None,
                        admin_socket=None, container_name=None,
-                       deploy_osp=False):
+                       deploy_osp=False, status_ttl=STATUS_CACHE_TTL,
+                       librados=False):
     ceph_status = get_ceph_status(client=client,
                                   keyring=keyring,
                                   container_name=container_name,
-                                  deploy_osp=deploy_osp)
+                                  deploy_osp=deploy_osp,
+                                  status_ttl=status_ttl,
+                                  librados=librados)
     try:
         mon = [m for m in ceph_status['monmap']['mons']
                if m['name'] == host]
@@ -200,13 +304,16 @@ def get_mon_statistics(client=None, keyring=None, host=None,
 
 def get_health_checks(client=None, keyring=None, section=None,
                       admin_socket=None, container_name=None,
-                      deploy_osp=False):
+                      deploy_osp=False, status_ttl=STATUS_CACHE_TTL,
+                      librados=False):
     metrics = []
 
     ceph_status = get_ceph_status(client=client,
                                   keyring=keyring,
                                   container_name=container_name,
-                                  deploy_osp=deploy_osp)
+                                  deploy_osp=deploy_osp,
+                                  status_ttl=status_ttl,
+                                  librados=librados)
 
     # Go through the detailed health checks and generate metrics
     # for each based on the given section
@@ -252,15 +359,44 @@ def get_osd_statistics(client=None, keyring=None, osd_id=None,
         metric_bool(metric_name, state)
 
 
+def get_osds_statistics(client=None, keyring=None, socket_dir=None,
+                        osd_ids=None, admin_socket=None, container_name=None,
+                        deploy_osp=False):
+    """Report the state of every OSD on this host in one pass.
+
+    The OSD admin sockets are queried directly, no container exec is
+    needed however many OSDs the host has. The OSDs in osd_ids are
+    reported down when their admin socket is missing, a stopped OSD
+    removes its socket.
+    """
+    sockets = find_osd_admin_sockets(socket_dir or ADMIN_SOCKET_DIR)
+    if not sockets and not osd_ids:
+        raise MaaSException('No OSD admin sockets found in %s'
+                            % (socket_dir or ADMIN_SOCKET_DIR))
+
+    for osd_id in sorted(set(sockets) | set(osd_ids or []),
+                         key=lambda i: (len(i), i)):
+        try:
+            osd_info = admin_socket_command(sockets[osd_id], 'status')
+        except (KeyError, IOError, OSError, ValueError):
+            state = 0
+        else:
+            state = 1 if osd_info.get('state', '') == 'active' else 0
+        metric_bool('osd.%s_up' % osd_id, state)
+
+
 def get_cluster_statistics(client=None, keyring=None, admin_socket=None,
                            container_name=None,
-                           deploy_osp=False):
+                           deploy_osp=False, status_ttl=STATUS_CACHE_TTL,
+                           librados=False):
     metrics = []
 
     ceph_status = get_ceph_status(client=client,
                                   keyring=keyring,
                                   container_name=container_name,
-                                  deploy_osp=deploy_osp)
+                                  deploy_osp=deploy_osp,
+                                  status_ttl=status_ttl,
+                                  librados=librados)
     # Get overall cluster health
     # For luminous+ this is the ceph_status.health.status
     # For < Luminous this is the ceph_status.health.overall_status
@@ -359,10 +495,26 @@ def get_args():
                         required=False,
                         default=None,
                         help='Ceph Container Name')
+    parser.add_argument('--container-role',
+                        required=False,
+                        default=None,
+                        help='Run the ceph commands in the first running '
+                             'container of this role (ceph_mon) when no '
+                             '--container-name is given')
     parser.add_argument('--admin-socket',
                         required=False,
                         default=None,
                         help='Socket for admin/daemon commands')
+    parser.add_argument('--status-ttl',
+                        type=int,
+                        default=STATUS_CACHE_TTL,
+                        help='Seconds a "ceph status" snapshot is shared '
+                             'between checks, 0 disables the cache')
+    parser.add_argument('--librados',
+                        action='store_true',
+                        default=False,
+                        help='Query the monitors through librados instead '
+                             'of the ceph CLI')
 
     subparsers = parser.add_subparsers(dest='subparser_name')
 
@@ -372,6 +524,13 @@ def get_args():
     parser_osd = subparsers.add_parser('osd')
     parser_osd.add_argument('--osd_id', required=True, type=str,
                             help='A single OSD ID')
+    parser_osds = subparsers.add_parser('osds')
+    parser_osds.add_argument('--socket-dir', default=ADMIN_SOCKET_DIR,
+                             help='Directory holding the OSD admin sockets')
+    parser_osds.add_argument('--osd_id', dest='osd_ids', action='append',
+                             default=[], type=str,
+                             help='An OSD ID expected on this host, can be '
+                                  'given several times')
     parser_rgw = subparsers.add_parser('rgw')
     parser_rgw.add_argument('--rgw_address', required=True,
                             help='RGW address in form proto://ip_addr:port/')
@@ -396,6 +555,7 @@ def main(args):
                       'mon': get_mon_statistics,
                       'rgw': get_rgw_checkup,
                       'osd': get_osd_statistics,
+                      'osds': get_osds_statistics,
                       'health_checks': get_health_checks}
 
     kwargs = {'client': args.name,
@@ -404,14 +564,26 @@ def main(args):
 
     if args.subparser_name == 'osd':
         kwargs['osd_id'] = args.osd_id
+    if args.subparser_name == 'osds':
+        kwargs['socket_dir'] = args.socket_dir
+        kwargs['osd_ids'] = args.osd_ids
     if args.subparser_name == 'mon':
         kwargs['host'] = args.host
     if args.subparser_name == 'rgw':
         kwargs['rgw_address'] = args.rgw_address
     if args.subparser_name == 'health_checks':
         kwargs['section'] = args.section
+    if args.subparser_name in ('cluster', 'mon', 'health_checks'):
+        kwargs['status_ttl'] = args.status_ttl
+        kwargs['librados'] = args.librados
 
     kwargs['container_name'] = args.container_name
+    if not args.container_name and args.container_role:
+        container = find_container(args.container_role)
+        if container is None:
+            raise MaaSException('No running container found for %s'
+                                % args.container_role)
+        kwargs['container_name'] = container.name
     kwargs['deploy_osp'] = args.deploy_osp
 
     get_statistics[args.subparser_name](**kwargs)
@@ -16,8 +16,12 @@
 
 import argparse
 import ctypes
+import ctypes.util
 import errno
 import os
+import queue
+import threading
+import time
 
 try:
     import lxc
@@ -25,11 +29,21 @@ try:
 except ImportError:
     lxc_module_active = False
     pass
-from pyroute2 import netns
 
 import maas_common
 
 
+NETNS_DIR = '/var/run/netns'
+CLONE_NEWNET = 0x40000000
+CONNTRACK_COUNT = '/proc/sys/net/netfilter/nf_conntrack_count'
+# Namespaces not read within this many seconds are reported as skipped.
+NETNS_DEADLINE = 40
+# Lower bounds, in percent of nf_conntrack_max, of the fill histogram.
+FILL_BUCKETS = [25, 50, 75, 90]
+# Each ranked namespace adds two metrics to the dozen reported for the
+# host, which stays within maas_common.MAX_METRICS.
+MAX_TOP = 10
+
 METRICS = {
     'nf_conntrack_count': {
         'path': '/proc/sys/net/netfilter/nf_conntrack_count',
@@ -70,16 +84,91 @@ class NsEnter(object):
         return self.exit()
 
 
-class NetNsExec(object):
-
-    def __init__(self, ns):
-        self.ns = ns
+class NetNsReader(object):
+    """Read nf_conntrack_count of many network namespaces in parallel.
 
-    def __enter__(self):
-        return netns.pushns(newns=self.ns)
+    setns() only moves the calling thread, so each worker thread of the
+    pool switches itself into the namespace it has to read instead of the
+    whole process pushing and popping every namespace in turn.
+    """
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        return netns.popns()
+    def __init__(self, workers=8, deadline=NETNS_DEADLINE):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.workers = workers
+        self.deadline = deadline
+
+    def setns(self, ns):
+        fd = os.open(os.path.join(NETNS_DIR, ns), os.O_RDONLY)
+        try:
+            if self.libc.setns(fd, CLONE_NEWNET) != 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err), ns)
+        finally:
+            os.close(fd)
+
+    def read(self, ns):
+        self.setns(ns)
+        return get_value(path=CONNTRACK_COUNT)
+
+    def read_all(self, namespaces):
+        """Return the counts of namespaces and the number not read.
+
+        Namespaces removed while being read are skipped, as are the ones
+        not read before the deadline. The readers are daemon threads which
+        are not waited for, so a namespace whose read hangs past the
+        deadline cannot hold the check until the agent kills it.
+        """
+        pending = queue.Queue()
+        for ns in namespaces:
+            pending.put(ns)
+        results = queue.Queue()
+
+        def reader():
+            while True:
+                try:
+                    ns = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results.put((ns, self.read(ns), None))
+                except OSError as e:
+                    results.put((ns, None, e))
+
+        for _ in range(min(self.workers, len(namespaces))):
+            thread = threading.Thread(target=reader)
+            thread.daemon = True
+            thread.start()
+
+        counts = dict()
+        end = time.monotonic() + self.deadline
+        try:
+            for _ in namespaces:
+                try:
+                    ns, count, error = results.get(
+                        timeout=max(end - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if error is None:
+                    counts[ns] = count
+                elif error.errno != errno.ENOENT:
+                    raise error
+        finally:
+            # The readers stop once the namespaces not started are dropped
+            while not pending.empty():
+                try:
+                    pending.get_nowait()
+                except queue.Empty:
+                    break
+        return counts, len(namespaces) - len(counts)
+
+
+def list_netns():
+    try:
+        return sorted(os.listdir(NETNS_DIR))
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
 
 
 def parse_args():
@@ -87,6 +176,19 @@ def parse_args():
         description='Check netfilter conntrack')
     parser.add_argument('--container', nargs='?',
                         help='Name of the container to check against')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of namespaces read in parallel')
+    parser.add_argument('--deadline', type=int, default=NETNS_DEADLINE,
+                        help='Seconds after which the namespaces not read '
+                             'yet are skipped')
+    parser.add_argument('--top', type=int, default=3,
+                        choices=range(MAX_TOP + 1),
+                        metavar='{0-%d}' % MAX_TOP,
+                        help='Number of namespaces reported by fill ratio')
+    parser.add_argument('--change-threshold', type=float, default=5,
+                        help='Percentage points the fill ratio of a namespace '
+                             'has to move by between two runs to be counted '
+                             'as changed')
     parser.add_argument('--telegraf-output',
                         action='store_true',
                         default=False,
@@ -107,32 +209,119 @@ def get_value(path):
         return value
 
 
-def get_metrics(netns_list=None):
+def percentile(values, percent):
+    """Nearest-rank percentile of a non empty list of values."""
+    values = sorted(values)
+    rank = max(int(-(-len(values) * percent // 100)), 1)
+    return values[rank - 1]
+
+
+def fill_histogram(ns_fill):
+    """Return the number of namespaces at or above each of FILL_BUCKETS."""
+    return dict((bucket, len([f for f in ns_fill.values() if f >= bucket]))
+                for bucket in FILL_BUCKETS)
+
+
+def compare_fill(ns_fill, previous, threshold):
+    """Compare the fill ratios with the ones of the previous run.
+
+    Returns the number of namespaces whose fill ratio moved by at least
+    threshold percentage points, and the namespace with the largest rise
+    as a (namespace, rise) tuple or None. Namespaces new since the
+    previous run are compared to an empty table.
+    """
+    changed = 0
+    rise = None
+    for ns, fill in ns_fill.items():
+        delta = fill - previous.get(ns, 0)
+        if abs(delta) >= threshold:
+            changed += 1
+        if delta > 0 and (rise is None or delta > rise[1]):
+            rise = (ns, delta)
+    return changed, rise
+
+
+def get_metrics(netns_list=None, workers=8, deadline=NETNS_DEADLINE, top=3,
+                cache_name=None, change_threshold=5):
     """Return Metrics for contract values.
 
     This function will return the highest value of "nf_conntrack_count" from
-    all available namespaces.
+    all available namespaces, along with the 95th percentile, a histogram
+    of the fill ratios of nf_conntrack_max and the top namespaces by fill
+    ratio. When cache_name is given the fill ratios are kept for the next
+    run, and the namespaces which changed significantly since the previous
+    run are reported.
 
     :returns: ``dict``
     """
     for key in METRICS.keys():
         METRICS[key]['value'] = get_value(METRICS[key]['path'])
 
-    ns_count = [METRICS['nf_conntrack_count']['value']]
-    for ns in netns_list or netns.listnetns():
-        with NetNsExec(ns=ns):
-            ns_count.append(
-                get_value(
-                    path='/proc/sys/net/netfilter/nf_conntrack_count'
-                )
-            )
+    if netns_list is None:
+        netns_list = list_netns()
+    reader = NetNsReader(workers=workers, deadline=deadline)
+    ns_count, skipped = reader.read_all(netns_list)
+    ns_count['host'] = METRICS['nf_conntrack_count']['value']
+
+    conntrack_max = METRICS['nf_conntrack_max']['value']
+    METRICS['nf_conntrack_count']['value'] = max(ns_count.values())
+    METRICS['nf_conntrack_count_p95'] = {
+        'type': 'uint32',
+        'value': percentile(ns_count.values(), 95)
+    }
+    METRICS['nf_conntrack_namespaces'] = {
+        'type': 'uint32',
+        'value': len(ns_count)
+    }
+    METRICS['nf_conntrack_namespaces_skipped'] = {
+        'type': 'uint32',
+        'value': skipped
+    }
 
-    METRICS['nf_conntrack_count']['value'] = max(ns_count)
+    ns_fill = dict((ns, round(100.0 * count / max(conntrack_max, 1), 2))
+                   for ns, count in ns_count.items())
+    for bucket, count in sorted(fill_histogram(ns_fill).items()):
+        METRICS['nf_conntrack_namespaces_fill_ge_%d' % bucket] = {
+            'type': 'uint32',
+            'value': count
+        }
+
+    busiest = sorted(ns_fill.items(), key=lambda i: (-i[1], i[0]))[:top]
+    for rank, (ns, fill) in enumerate(busiest, 1):
+        METRICS['nf_conntrack_top_%d_namespace' % rank] = {
+            'type': 'string',
+            'value': ns
+        }
+        METRICS['nf_conntrack_top_%d_fill' % rank] = {
+            'type': 'double',
+            'value': fill,
+            'unit': 'percent'
+        }
+
+    if cache_name:
+        previous = maas_common.read_cache(cache_name)
+        maas_common.write_cache(cache_name, ns_fill)
+        if previous is not None:
+            changed, rise = compare_fill(ns_fill, previous, change_threshold)
+            METRICS['nf_conntrack_namespaces_changed'] = {
+                'type': 'uint32',
+                'value': changed
+            }
+            if rise:
+                METRICS['nf_conntrack_top_rise_namespace'] = {
+                    'type': 'string',
+                    'value': rise[0]
+                }
+                METRICS['nf_conntrack_top_rise'] = {
+                    'type': 'double',
+                    'value': round(rise[1], 2),
+                    'unit': 'percent'
+                }
 
     return METRICS
 
 
-def get_metrics_lxc_container(container_name):
+def get_metrics_lxc_container(container_name, **kwargs):
     # Create lxc container object
     cont = lxc.Container(container_name)
     container_pid = int(cont.init_pid)
@@ -142,13 +331,18 @@ def get_metrics_lxc_container(container_name):
         )
 
     with NsEnter(pid=container_pid, ns_type='net'):
-        return get_metrics()
+        return get_metrics(**kwargs)
 
 
 def main():
+    options = dict(workers=args.workers,
+                   deadline=args.deadline,
+                   top=args.top,
+                   cache_name='conntrack_fill_%s' % (args.container or 'host'),
+                   change_threshold=args.change_threshold)
     try:
         if not args.container:
-            metrics = get_metrics()
+            metrics = get_metrics(**options)
         else:
             if not lxc_module_active:
                 raise maas_common.MaaSException(
@@ -156,14 +350,15 @@ def main():
                     'lxc-python pip module not installed within the plugin'
                     'execution path.'
                 )
-            metrics = get_metrics_lxc_container(args.container)
+            metrics = get_metrics_lxc_container(args.container, **options)
 
     except maas_common.MaaSException as e:
         maas_common.status_err(str(e), m_name='maas_conntrack')
     else:
         maas_common.status_ok(m_name='maas_conntrack')
         for name, data in metrics.items():
-            maas_common.metric(name, 'uint32', data['value'])
+            maas_common.metric(name, data.get('type', 'uint32'),
+                               data['value'], data.get('unit'))
 
 
 if __name__ == '__main__':
@@ -15,50 +15,102 @@
 # limitations under the License.
 
 import argparse
+import concurrent.futures
 import os
+import re
 
 import lxc
 
+from maas_common import metric
 from maas_common import metric_bool
 from maas_common import print_output
 from maas_common import status_err
 from maas_common import status_ok
 
 
-def disk_partitions(container):
-    """runs df in container pid/mnt/user namespace"""
-    try:
-        r, w = os.pipe()
-        with os.fdopen(w, 'w') as fh:
-            cmd = 'df -x devtmpfs -x tmpfs -x debugfs'.split()
-            container.attach_wait(lxc.attach_run_command, cmd, stdout=fh)
-        with os.fdopen(r) as fh:
-            return fh.read().splitlines()[1:]
-    except OSError:
-        return []
-
-
-def disk_usage(part):
-    """gets usage percentage from df output lines"""
-    try:
-        return int(part.split()[4].rstrip('%'))
-    except:
-        return 0
-
-
-def container_check(thresh):
-    containers = lxc.list_containers()
-    for container in containers:
+# Filesystems df was told to leave out, and network filesystems whose
+# statvfs can hang the check when the server is unreachable.
+EXCLUDED_FS_TYPES = ('devtmpfs', 'tmpfs', 'debugfs',
+                     'nfs', 'nfs4', 'cifs', 'smb3')
+
+
+def _unescape(path):
+    """Decode the octal escapes (\040 for a space) of mountinfo paths.
+
+    Only those escapes are decoded, any other backslash or non ASCII
+    character of the path is kept as it is.
+    """
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), path)
+
+
+def container_mounts(pid):
+    """Return the mount points of the mount namespace of pid."""
+    mounts = []
+    with open('/proc/%d/mountinfo' % pid) as f:
+        for line in f:
+            # The optional fields end with a single '-' field
+            fields, _, fs_fields = line.partition(' - ')
+            mount_point = _unescape(fields.split()[4])
+            fs_type = fs_fields.split()[0]
+            if fs_type in EXCLUDED_FS_TYPES:
+                continue
+            if mount_point not in mounts:
+                mounts.append(mount_point)
+    return mounts
+
+
+def disk_usage(pid, mount_point):
+    """Return the percentage used of a mount of the container like df does,
+    or None for pseudo filesystems without any blocks."""
+    st = os.statvfs('/proc/%d/root%s' % (pid, mount_point))
+    used = st.f_blocks - st.f_bfree
+    total = used + st.f_bavail
+    if not st.f_blocks or not total:
+        return None
+    # df rounds the percentage up
+    return -(-used * 100 // total)
+
+
+def disk_partitions(name, pid):
+    """Return (percent used, container, mount point) of every mount of the
+    container, read through /proc/<pid>/root of its init process."""
+    partitions = []
+    for mount_point in container_mounts(pid):
+        try:
+            percent_used = disk_usage(pid, mount_point)
+        except OSError:
+            continue
+        if percent_used is not None:
+            partitions.append((percent_used, name, mount_point))
+    return partitions
+
+
+def container_check(thresh, top=3):
+    """Return whether every container mount is below thresh, and the top
+    mounts by usage.
+
+    The containers are scanned in parallel. Stopped containers, or ones
+    which stopped while being scanned, are skipped.
+    """
+    pids = dict()
+    for container in lxc.list_containers():
         c = lxc.Container(container)
-        if c.init_pid == -1:
-            return True
+        if c.init_pid != -1:
+            pids[container] = c.init_pid
 
-        for partition in disk_partitions(c):
-            percent_used = disk_usage(part=partition)
-            if percent_used >= thresh:
-                return False
-    else:
-        return True
+    partitions = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(disk_partitions, name, pid)
+                   for name, pid in pids.items()]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                partitions.extend(future.result())
+            except (IOError, OSError):
+                continue
+
+    partitions.sort(key=lambda p: (-p[0], p[1], p[2]))
+    below = not partitions or partitions[0][0] < thresh
+    return below, partitions[:top]
 
 
 def get_args():
@@ -73,13 +125,20 @@ def get_args():
         type=int,
         help='Critical threshold'
     )
+    parser.add_argument('--top',
+                        type=int,
+                        default=3,
+                        choices=range(11),
+                        metavar='{0-10}',
+                        help='Number of container mounts reported by usage')
     return parser.parse_args()
 
 
 def main():
     _container_check = False
     try:
-        _container_check = container_check(thresh=args.thresh)
+        _container_check, worst = container_check(thresh=args.thresh,
+                                                  top=args.top)
     except Exception as e:
         metric_bool(
             'container_storage_percent_used_critical',
@@ -92,6 +151,13 @@ def main():
             'container_storage_percent_used_critical',
             _container_check, m_name='maas_container'
         )
+        for rank, (percent_used, name, mount_point) in enumerate(worst, 1):
+            metric('container_storage_top_%d_container' % rank, 'string',
+                   name, m_name='maas_container')
+            metric('container_storage_top_%d_mount' % rank, 'string',
+                   mount_point, m_name='maas_container')
+            metric('container_storage_top_%d_percent_used' % rank, 'uint32',
+                   percent_used, '%', m_name='maas_container')
 
 
 if __name__ == '__main__':
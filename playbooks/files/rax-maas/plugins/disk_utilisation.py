@@ -15,34 +15,135 @@
 # limitations under the License.
 
 import argparse
-import shlex
-import subprocess
+import os
+import time
 
+from maas_common import MAX_METRICS
+from maas_common import MaaSException
 from maas_common import metric
 from maas_common import print_output
+from maas_common import sample_delta
 from maas_common import status_err
 from maas_common import status_ok
 
 
-def utilisation(args, time):
-    output = subprocess.check_output(
-        shlex.split('iostat {device} -x -d {time} 2'
-                    .format(device=args.device,
-                            time=time)
-                    ))
+DISKSTATS = '/proc/diskstats'
+SYS_BLOCK = '/sys/block'
+SECTOR_SIZE = 512
+# Seconds between the two samples of a run without a previous sample.
+FIRST_SAMPLE_INTERVAL = 1
+# Metrics reported per device when the devices fit within the 50 metrics
+# of a check, otherwise only the utilisation is reported. Hosts with more
+# disks than that are split across several checks by maas-host-cdm.yml.
+DEVICE_METRICS = 6
 
-    # pull the last line
-    last_stat_line = output.decode().strip().split('\n')[-1]
-    fields = last_stat_line.split(' ')
-    utils = [(fields[0], fields[-1])]
+# The counters of /proc/diskstats, see Documentation/admin-guide/iostats.rst
+DISKSTATS_FIELDS = ('reads', 'reads_merged', 'sectors_read', 'read_ms',
+                    'writes', 'writes_merged', 'sectors_written', 'write_ms',
+                    'in_progress', 'io_ms', 'weighted_ms')
+SAMPLED_FIELDS = ('reads', 'sectors_read', 'read_ms',
+                  'writes', 'sectors_written', 'write_ms', 'io_ms')
+
+
+def read_diskstats(path=DISKSTATS):
+    """Return the counters of every block device from a single read."""
+    stats = dict()
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            stats[fields[2]] = dict(zip(DISKSTATS_FIELDS,
+                                        map(int, fields[3:14])))
+    return stats
+
+
+def list_disks():
+    """Return the whole disks of the host, leaving out partitions,
+    loop and ram devices."""
+    return sorted(dev for dev in os.listdir(SYS_BLOCK)
+                  if os.path.exists(os.path.join(SYS_BLOCK, dev, 'device')))
+
+
+def sample(stats, devices):
+    """Return the increase of the counters of each device since the
+    previous sample, or None for the devices without a previous sample."""
+    deltas = dict()
+    for device in devices:
+        # /sys/block uses ! where /proc/diskstats uses / (cciss!c0d0)
+        counters = stats.get(device) or stats.get(device.replace('!', '/'))
+        if counters is None:
+            raise MaaSException('Device %s not found in %s'
+                                % (device, DISKSTATS))
+        delta = dict()
+        for field in SAMPLED_FIELDS:
+            delta[field], elapsed = sample_delta(
+                'disk_%s_%s' % (device, field), counters[field])
+        delta['elapsed'] = elapsed
+        deltas[device] = delta if elapsed else None
+    return deltas
+
+
+def utilisation(devices):
+    """Return the utilisation and I/O statistics of devices.
+
+    The counters are compared with the ones saved by the previous run, so
+    the values are averages over the check period. When there is no
+    previous sample, for example on the first run, two samples are taken
+    FIRST_SAMPLE_INTERVAL seconds apart instead.
+    """
+    if len(devices) > MAX_METRICS:
+        raise MaaSException('%d devices exceed the %d metrics of a check, '
+                            'split them across several checks'
+                            % (len(devices), MAX_METRICS))
+    deltas = sample(read_diskstats(), devices)
+    if None in deltas.values():
+        time.sleep(FIRST_SAMPLE_INTERVAL)
+        deltas = sample(read_diskstats(), devices)
+
+    utils = []
+    for device in devices:
+        delta = deltas[device]
+        elapsed = delta['elapsed']
+        ios = delta['reads'] + delta['writes']
+        io_ms = delta['read_ms'] + delta['write_ms']
+        utils.append({
+            'device': device,
+            'util': min(100.0 * delta['io_ms'] / (elapsed * 1000), 100.0),
+            'read_iops': delta['reads'] / elapsed,
+            'write_iops': delta['writes'] / elapsed,
+            'await': float(io_ms) / ios if ios else 0.0,
+            'read_bytes': delta['sectors_read'] * SECTOR_SIZE / elapsed,
+            'write_bytes': delta['sectors_written'] * SECTOR_SIZE / elapsed
+        })
     return utils
 
 
+def report(utils):
+    extended = len(utils) * DEVICE_METRICS <= MAX_METRICS
+    for util in utils:
+        device = util['device']
+        metric('disk_utilisation_%s' % device, 'double',
+               round(util['util'], 2), '%')
+        if not extended:
+            continue
+        metric('disk_read_iops_%s' % device, 'double',
+               round(util['read_iops'], 2), 'iops')
+        metric('disk_write_iops_%s' % device, 'double',
+               round(util['write_iops'], 2), 'iops')
+        metric('disk_await_%s' % device, 'double',
+               round(util['await'], 2), 'ms')
+        metric('disk_read_bytes_%s' % device, 'double',
+               round(util['read_bytes'], 2), 'bytes_per_second')
+        metric('disk_write_bytes_%s' % device, 'double',
+               round(util['write_bytes'], 2), 'bytes_per_second')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Disk utilisation checks')
     parser.add_argument('device',
                         type=str,
-                        help='Device we gather metric from')
+                        nargs='*',
+                        help='Devices we gather metrics from, every disk '
+                             'of the host when none are given')
     parser.add_argument('--telegraf-output',
                         action='store_true',
                         default=False,
@@ -50,10 +151,9 @@ if __name__ == '__main__':
     args = parser.parse_args()
     with print_output(print_telegraf=args.telegraf_output):
         try:
-            utils = utilisation(args, 5)
+            utils = utilisation(args.device or list_disks())
         except Exception as e:
             status_err(e, m_name='maas_disk_utilisation')
         else:
             status_ok(m_name='maas_disk_utilisation')
-            for util in utils:
-                metric('disk_utilisation_%s' % util[0], 'double', util[1], '%')
+            report(utils)
@@ -15,15 +15,104 @@
 # limitations under the License.
 
 import argparse
+import configparser
 import shlex
 import subprocess
 
+try:
+    import pymysql
+    pymysql_module_active = True
+except ImportError:
+    pymysql_module_active = False
 from maas_common import metric
 from maas_common import metric_bool
+from maas_common import metric_rate
 from maas_common import print_output
 from maas_common import status_err
 from maas_common import status_ok
 
+MY_CNF = '/root/.my.cnf'
+# Socket the mysql CLI connects to when no host is given and the option
+# files do not set one.
+MYSQL_SOCKET = '/var/run/mysqld/mysqld.sock'
+
+# Only the rows used by print_metrics and main are requested from the
+# server instead of the ~1000 rows of a plain SHOW GLOBAL STATUS/VARIABLES.
+STATUS_NAMES = [
+    'Aborted_clients',
+    'Aborted_connects',
+    'Access_denied_errors',
+    'Innodb_deadlocks',
+    'Innodb_row_lock_time_avg',
+    'Max_used_connections',
+    'Open_files',
+    'Queries',
+    'Threads_connected',
+    'wsrep_cluster_size',
+    'wsrep_cluster_state_uuid',
+    'wsrep_cluster_status',
+    'wsrep_commit_window',
+    'wsrep_local_state',
+    'wsrep_local_state_comment',
+    'wsrep_local_state_uuid',
+    'wsrep_received_bytes',
+    'wsrep_replicated_bytes',
+]
+VARIABLE_NAMES = [
+    'max_connections',
+    'open_files_limit',
+]
+
+
+def filtered_query(output_type):
+    if output_type == 'status':
+        names = STATUS_NAMES
+    else:
+        names = VARIABLE_NAMES
+    return "SHOW GLOBAL %s WHERE Variable_name IN (%s)" % (
+        output_type.upper(), ', '.join("'%s'" % n for n in names))
+
+
+def cnf_socket():
+    """Return the socket set in the sections of MY_CNF the mysql CLI reads."""
+    parser = configparser.RawConfigParser(allow_no_value=True, strict=False)
+    try:
+        parser.read(MY_CNF)
+    except configparser.Error:
+        return None
+    for section in ('client', 'mysql'):
+        if parser.has_option(section, 'socket'):
+            return parser.get(section, 'socket')
+    return None
+
+
+def galera_status(host, port):
+    """Read the filtered global status and variables over one connection.
+
+    The credentials come from the same /root/.my.cnf the mysql CLI uses.
+    Without a host the local server is reached over its unix socket, as
+    the CLI does, rather than over TCP to localhost.
+    """
+    kwargs = {'read_default_file': MY_CNF, 'connect_timeout': 10}
+    if host:
+        kwargs['host'] = host
+    else:
+        kwargs['unix_socket'] = cnf_socket() or MYSQL_SOCKET
+    if port:
+        kwargs['port'] = int(port)
+
+    replica_status = {}
+    conn = pymysql.connect(**kwargs)
+    try:
+        with conn.cursor() as cursor:
+            for output_type in ['status', 'variables']:
+                cursor.execute(filtered_query(output_type))
+                for name, value in cursor.fetchall():
+                    replica_status[name] = value
+    finally:
+        conn.close()
+    return replica_status
+
 
 def galera_check(arg):
     proc = subprocess.Popen(shlex.split(arg),
@@ -46,12 +135,8 @@ def generate_query(host, port, output_type='status'):
         port = ' -P %s' % port
     else:
         port = ''
-    if output_type == 'status':
-        return ('/usr/bin/mysql --defaults-file=/root/.my.cnf '
-                '%s%s -e "SHOW GLOBAL STATUS"') % (host, port)
-    elif output_type == 'variables':
-        return ('/usr/bin/mysql --defaults-file=/root/.my.cnf '
-                '%s%s -e "SHOW GLOBAL VARIABLES"') % (host, port)
+    return ('/usr/bin/mysql --defaults-file=%s '
+            '%s%s -e "%s"') % (MY_CNF, host, port, filtered_query(output_type))
 
 
 def parse_args():
@@ -85,8 +170,7 @@ def print_metrics(replica_status):
            replica_status['wsrep_commit_window'], 'sequence_delta')
     metric('wsrep_cluster_size', 'int64',
            replica_status['wsrep_cluster_size'], 'nodes')
-    metric('queries_per_second', 'int64',
-           replica_status['Queries'], 'qps')
+    metric_rate('queries_per_second', replica_status['Queries'], 'qps')
     metric('wsrep_cluster_state_uuid', 'string',
            replica_status['wsrep_cluster_state_uuid'])
     metric('wsrep_cluster_status', 'string',
@@ -117,11 +201,11 @@ def print_metrics(replica_status):
            replica_status['Aborted_connects'], 'aborted_connects')
 
 
-def main():
+def mysql_cli_status(host, port):
     replica_status = {}
     for output_type in ['status', 'variables']:
         retcode, output, err = galera_check(
-            generate_query(options.host, options.port, output_type=output_type)
+            generate_query(host, port, output_type=output_type)
         )
 
         if retcode > 0:
@@ -136,6 +220,23 @@ def main():
         show_list = output.decode().split('\n')[1:-1]
         for i in show_list:
             replica_status[i.split('\t')[0]] = i.split('\t')[1]
+    return replica_status
+
+
+def main():
+    if pymysql_module_active:
+        try:
+            replica_status = galera_status(options.host, options.port)
+        except pymysql.Error as e:
+            metric_bool('client_success', False, m_name='maas_galera')
+            status_err(str(e), m_name='maas_galera')
+    else:
+        replica_status = mysql_cli_status(options.host, options.port)
+
+    if not replica_status:
+        metric_bool('client_success', False, m_name='maas_galera')
+        status_err('No output received from mysql. Cannot gather metrics.',
+                   m_name='maas_galera')
 
     if replica_status['wsrep_cluster_status'] != "Primary":
         metric_bool('client_success', False, m_name='maas_galera')
@@ -15,13 +15,13 @@
 # limitations under the License.
 import argparse
 import datetime
-import os
 import shlex
 import subprocess
 
 from maas_common import metric
 from maas_common import metric_bool
 from maas_common import print_output
+from maas_common import running_containers
 from maas_common import status_err
 from maas_common import status_ok
 
@@ -61,15 +61,8 @@ def print_metrics(name, size):
 
 def holland_lb_check(hostname, binary, backupset):
     backupsets = []
-    container_present = True
-
-    try:
-        os.stat('/sys/fs/cgroup/pids/lxc/' + hostname)
-    except OSError:
-        try:
-            os.stat('/sys/fs/cgroup/pids/lxc.payload.' + hostname)
-        except OSError:
-            container_present = False
+    container = running_containers().get(hostname)
+    container_present = container is not None and container.runtime == 'lxc'
 
     if container_present:
         retcode, output, err = run_command('lxc-attach -n %s -- %s lb' %
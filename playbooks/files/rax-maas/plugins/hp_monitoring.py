@@ -15,23 +15,44 @@
 # limitations under the License.
 
 import argparse
+import concurrent.futures
+import functools
 import os
 import subprocess
+import threading
 
 from ipaddress import ip_address
 import maas_common
 import requests
 
 
+# The iLO address is resolved with ipmitool at most once a day.
+ILO_ADDRESS_TTL = 86400
+ILO_TIMEOUT = 10
+ILO_SESSION_CACHE = 'hp_ilo_session'
+SSACLI_CONFIG = ('ctrl', 'all', 'show', 'config')
+SSACLI_STATUS = ('ctrl', 'all', 'show', 'status')
+
+
 class BadOutputError(maas_common.MaaSException):
     pass
 
 
+class InvalidCredentials(maas_common.MaaSException):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def command_output(command):
+    """Run command once per check, several statuses are read from the
+    output of the same ssacli command."""
+    return subprocess.check_output(command).decode()
+
+
 def check_command(command, startswith, endswith):
     status = 0
     try:
-        output = subprocess.check_output(command)
-        lines = output.decode().split('\n')
+        lines = command_output(command).split('\n')
         matches = False
         for line in lines:
             line = line.strip()
@@ -51,6 +72,7 @@ def check_command(command, startswith, endswith):
 def get_ilo_address(command, startswith):
     output = subprocess.check_output(command)
     lines = output.decode('UTF-8').split('\n')
+    ip = None
     for line in lines:
         line = line.strip()
         if line.startswith(startswith):
@@ -60,87 +82,146 @@ def get_ilo_address(command, startswith):
             except ValueError:
                 maas_common.status_err("Unable to detect valid IP address.",
                                        m_name='hp_monitoring')
+    if ip is None:
+        raise BadOutputError('No iLO address in the output of %s'
+                             % ' '.join(command))
     return ip
 
 
-def create_http_session(url=None, user=None, password=None):
-    if url:
-        try:
-            s = requests.Session()
-            s.headers.update({"Content-type": "application/json"})
-            s.auth = (user, password)
-
-            return s.get(url, verify=False, timeout=10)
-        except requests.exceptions.ConnectTimeout:
-            maas_common.status_err("Timeout connecting to iLO "
-                                   "address: %s" % url,
-                                   m_name='hp_monitoring')
-    else:
-        return None
-
-
-def get_health_status_from_ilo(addr):
-    ilo_ver = 5
-    url = "https://%s/redfish/v1" % addr
-    user, password = args.ilo_credentials.split(':')
-    r = create_http_session(url, user, password)
-
-    if r.ok:
-        """
-        Determine the OEM extension name as HP sadly renamed the extension from
-        Hp to Hpe with iLO5
-        """
-        oem_extension = list(r.json().get('Oem').keys()).pop()
-        if r.json().get('Oem').get(oem_extension) \
-           .get('Manager')[0]['ManagerType'] == 'iLO 4':
-            ilo_ver = 4
-
+class RedfishClient(object):
+    """Redfish client for the iLO, reusing its session across runs.
+
+    The X-Auth-Token of the Redfish session is kept in the maas_common
+    cache with the OEM extension name and iLO version detected from the
+    service root, so a run normally goes straight to the resources it
+    needs. A new session is only created when the iLO rejects the token,
+    for example after it expired or the iLO was reset.
+    """
+
+    def __init__(self, address, user, password, timeout=ILO_TIMEOUT):
+        self.base_url = 'https://%s' % address
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update({'Content-type': 'application/json'})
+        self.session.verify = False
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=4)
+        self.session.mount('https://', adapter)
+
+        self.state = maas_common.read_cache(ILO_SESSION_CACHE) or {}
+        cached = (self.state.get('address'), self.state.get('user'))
+        if cached != (address, user):
+            self.state = {'address': address, 'user': user}
+
+    def save(self):
+        maas_common.write_cache(ILO_SESSION_CACHE, self.state)
+
+    def login(self):
+        r = self.session.post(
+            self.base_url + '/redfish/v1/SessionService/Sessions/',
+            json={'UserName': self.user, 'Password': self.password},
+            timeout=self.timeout)
+        if r.status_code in (400, 401, 403):
+            raise InvalidCredentials('Invalid iLO credentials. Unable to '
+                                     'obtain component health status.')
+        r.raise_for_status()
+        self.state['token'] = r.headers['X-Auth-Token']
+        self.save()
+
+    def get(self, path):
+        token = self.state.get('token')
+        if token:
+            r = self.session.get(self.base_url + path,
+                                 headers={'X-Auth-Token': token},
+                                 timeout=self.timeout)
+        if not token or r.status_code == 401:
+            with self.lock:
+                # Only one of the concurrent requests logs in again
+                if self.state.get('token') == token:
+                    self.login()
+            r = self.session.get(
+                self.base_url + path,
+                headers={'X-Auth-Token': self.state['token']},
+                timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def get_many(self, paths):
+        """Fetch several resources concurrently."""
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(paths)) as pool:
+            return list(pool.map(self.get, paths))
+
+    def detect(self):
+        """Return the OEM extension name and the iLO version."""
+        if 'oem' not in self.state:
+            oem = self.get('/redfish/v1').get('Oem')
+            # Determine the OEM extension name as HP sadly renamed the
+            # extension from Hp to Hpe with iLO5
+            oem_extension = list(oem.keys()).pop()
+            manager_type = oem[oem_extension]['Manager'][0]['ManagerType']
+            self.state['oem'] = oem_extension
+            self.state['version'] = 4 if manager_type == 'iLO 4' else 5
+            self.save()
+        return self.state['oem'], self.state['version']
+
+
+def get_health_status_from_ilo(client):
+    oem_extension, ilo_ver = client.detect()
+
+    if ilo_ver == 4:
         """
         Emulate iLO5 AggregateHealthStatus for iLO4 to simplify existing
         iLO code
         """
-        if ilo_ver == 4:
-            health_status = dict()
-
-            sys_url = "https://%s/redfish/v1/Systems/1" % addr
-            sys = create_http_session(sys_url, user, password)
-
-            chassis_url = "https://%s/redfish/v1/Chassis/1" % addr
-            chassis = create_http_session(chassis_url, user, password)
-
-            if sys.ok:
-                health_status['Processors'] = {'Status': {'Health':
-                                               sys.json().get('Processors')
-                                               .get('Status')
-                                               .get('HealthRollUp')}}
-
-                health_status['Memory'] = {'Status': {'Health':
-                                           sys.json().get('Memory')
-                                           .get('Status')
-                                           .get('HealthRollUp')}}
-
-                health_status['PowerSupplies'] = {'Status': {'Health':
-                                                  chassis.json()
-                                                  .get('Status')
-                                                  .get('Health')}}
-            else:
-                health_status['Processors'] = None
-                health_status['Memory'] = None
-                health_status['PowerSupplies'] = None
-            return health_status
-        elif ilo_ver == 5:
-            sys_url = "https://%s/redfish/v1/Systems/1" % addr
-            sys = create_http_session(sys_url, user, password)
-
-            return sys.json().get('Oem').get(oem_extension) \
-                                        .get('AggregateHealthStatus')
-        else:
-            maas_common.status_err('Could not determine iLO version',
-                                   m_name='hp_monitoring')
-
-    if r.status_code == 401:
-        maas_common.status_err('Invalid iLO credentials. Unable to obtain '
-                               'component health status.',
+        sys, chassis = client.get_many(['/redfish/v1/Systems/1',
+                                        '/redfish/v1/Chassis/1'])
+        health_status = dict()
+        health_status['Processors'] = {'Status': {'Health':
+                                       sys.get('Processors')
+                                       .get('Status')
+                                       .get('HealthRollUp')}}
+
+        health_status['Memory'] = {'Status': {'Health':
+                                   sys.get('Memory')
+                                   .get('Status')
+                                   .get('HealthRollUp')}}
+
+        health_status['PowerSupplies'] = {'Status': {'Health':
+                                          chassis.get('Status')
+                                          .get('Health')}}
+        return health_status
+
+    sys = client.get('/redfish/v1/Systems/1')
+    return sys.get('Oem').get(oem_extension).get('AggregateHealthStatus')
+
+
+def ilo_health_status(credentials):
+    """Return the component health status reported by the iLO."""
+    ilo_address = maas_common.get_cached(
+        'hp_ilo_address', ILO_ADDRESS_TTL, get_ilo_address,
+        ('ipmitool', 'lan', 'print'), 'IP Address   ')
+    user, password = credentials.split(':')
+    client = RedfishClient(ilo_address, user, password)
+    try:
+        return get_health_status_from_ilo(client)
+    except InvalidCredentials as e:
+        maas_common.status_err(str(e), m_name='hp_monitoring')
+    except requests.exceptions.ConnectionError:
+        # Resolve the address again in case the iLO was readdressed
+        maas_common.write_cache('hp_ilo_address', None)
+        maas_common.status_err("Timeout connecting to iLO "
+                               "address: %s" % ilo_address,
+                               m_name='hp_monitoring')
+    except requests.exceptions.RequestException as e:
+        maas_common.status_err("Error querying iLO address %s: %s"
+                               % (ilo_address, e), m_name='hp_monitoring')
+    except (KeyError, ValueError) as e:
+        maas_common.status_err("Unexpected response from iLO address "
+                               "%s: %r" % (ilo_address, e),
                                m_name='hp_monitoring')
 
 
@@ -162,27 +243,27 @@ def get_powersupply_status(command, item):
 
 
 def get_logicaldrive_status(command):
-    return check_command((command, 'ctrl', 'all', 'show', 'config'),
+    return check_command((command,) + SSACLI_CONFIG,
                          'logicaldrive', ('OK)', 'OK, Encrypted)'))
 
 
 def get_physicaldrive_status(command):
-    return check_command((command, 'ctrl', 'all', 'show', 'config'),
+    return check_command((command,) + SSACLI_CONFIG,
                          'physicaldrive', ('OK)', 'OK, Encrypted)'))
 
 
 def get_controller_status(command):
-    return check_command((command, 'ctrl', 'all', 'show', 'status'),
+    return check_command((command,) + SSACLI_STATUS,
                          'Controller Status', 'OK')
 
 
 def get_controller_cache_status(command):
-    return check_command((command, 'ctrl', 'all', 'show', 'status'),
+    return check_command((command,) + SSACLI_STATUS,
                          'Cache Status', ('OK', 'Not Configured'))
 
 
 def get_controller_battery_status(command):
-    return check_command((command, 'ctrl', 'all', 'show', 'status'),
+    return check_command((command,) + SSACLI_STATUS,
                          'Battery/Capacitor Status', 'OK')
 
 
@@ -202,13 +283,15 @@ def main():
     status = {}
     ilo_check = True if args.ilo_credentials else False
 
-    if bool(ilo_check):
-        ilo_address = get_ilo_address(('ipmitool', 'lan', 'print'),
-                                      'IP Address   ')
-
-        # Gather health output from iLO API
-        health_status = get_health_status_from_ilo(ilo_address)
+    # The slow ssacli commands run while the iLO is queried
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        for command in (SSACLI_CONFIG, SSACLI_STATUS):
+            pool.submit(command_output, (ssacli_bin,) + command)
+        if bool(ilo_check):
+            # Gather health output from iLO API
+            health_status = ilo_health_status(args.ilo_credentials)
 
+    if bool(ilo_check):
         # Parse output
         status['hardware_processors_status'] = \
             parse_component_health(health_status['Processors'])
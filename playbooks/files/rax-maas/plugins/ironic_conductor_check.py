@@ -18,7 +18,7 @@ import argparse
 
 from maas_common import metric_bool
 from maas_common import print_output
-import psutil
+from maas_common import process_snapshot
 
 
 def check(args):
@@ -27,8 +27,8 @@ def check(args):
     # in ironic v1.49 and onward. Instead, we look for the process
     # directly until it becomes available within the API.
     name = "ironic-conductor_status"
-    for proc in psutil.process_iter():
-        if 'ironic-conducto' in proc.name():
+    for proc in process_snapshot():
+        if 'ironic-conducto' in proc.name:
             metric_bool(name, True)
             break
     else:
@@ -14,21 +14,24 @@
 # limitations under the License.
 from __future__ import print_function
 
+import codecs
+import collections
 import contextlib
-import distro
 import errno
+import fcntl
+import json
 import logging
 import os
-import pickle
 import re
 import sys
+import time
 import traceback
+import warnings
 
-from keystoneauth1.exceptions import MissingRequiredOptions
-from monitorstack.common import formatters
-from openstack import connect
-import requests
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+# NOTE: The OpenStack SDK, keystoneauth1, requests, monitorstack and distro
+#       are only imported by the functions that need them. Host checks only
+#       use the status and metric helpers and should not pay for importing
+#       them on every run.
 
 AUTH_DETAILS = {'OS_USERNAME': None,
                 'OS_PASSWORD': None,
@@ -43,27 +46,46 @@ AUTH_DETAILS = {'OS_USERNAME': None,
                 'OS_IMAGE_API_VERSION': 1,
                 'OS_CLOUDNAME': 'overcloud'}
 
-if 'Ubuntu' in distro.name():
-    AUTH_DETAILS.update({
-        'OS_USER_DOMAIN_NAME': None,
-        'OS_PROJECT_DOMAIN_NAME': None,
-        'OS_PROJECT_NAME': None,
-        'OS_AUTH_VERSION': None,
-        'OS_TENANT_NAME': None,
-        'OS_ENDPOINT_TYPE': None,
-        'OS_API_INSECURE': True,
-        'OS_REGION_NAME': 'RegionOne',
-        'OS_CLOUDNAME': 'default'
-    })
-
-
-# Disabling insecure requests warnings in case OS_API_INSECURE is set:
+UBUNTU_AUTH_DETAILS = {'OS_USER_DOMAIN_NAME': None,
+                       'OS_PROJECT_DOMAIN_NAME': None,
+                       'OS_PROJECT_NAME': None,
+                       'OS_AUTH_VERSION': None,
+                       'OS_TENANT_NAME': None,
+                       'OS_ENDPOINT_TYPE': None,
+                       'OS_API_INSECURE': True,
+                       'OS_REGION_NAME': 'RegionOne',
+                       'OS_CLOUDNAME': 'default'}
+_AUTH_DETAILS_LOADED = False
+
+
+# Disabling insecure requests warnings in case OS_API_INSECURE is set. A
+# warnings filter is used so requests does not need to be imported here.
 if AUTH_DETAILS.get('OS_API_INSECURE') is True:
-    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+    warnings.filterwarnings('ignore', message='Unverified HTTPS request')
 
 OPENRC = '/root/openrc'
 STACKRC = '/home/stack/stackrc'
-PICKLE_FILE = '/root/.auth_ref.pkl'
+TOKEN_CACHE_FILE = '/root/.auth_ref.json'
+TOKEN_CACHE_LOCK = '/root/.auth_ref.lock'
+# Pickled token cache of earlier releases, removed once the JSON one exists.
+LEGACY_TOKEN_CACHE_FILE = '/root/.auth_ref.pkl'
+# Refresh the cached token this many seconds before it expires.
+TOKEN_EXPIRY_MARGIN = int(os.environ.get('MAAS_TOKEN_EXPIRY_MARGIN', 300))
+# State shared between plugin runs, on tmpfs so nothing survives a reboot.
+CACHE_DIR = os.environ.get('MAAS_CACHE_DIR', '/run/rpc-maas')
+# Counter samples not updated for this many seconds are forgotten.
+SAMPLE_EXPIRY = 86400
+PROC_DIR = '/proc'
+PODMAN_CONTAINERS_FILE = ('/var/lib/containers/storage/overlay-containers/'
+                          'containers.json')
+DOCKER_CONTAINERS_DIR = '/var/lib/docker/containers'
+# Seconds a process snapshot taken by one check is reused by the others.
+PROCESS_SNAPSHOT_TTL = int(os.environ.get('MAAS_PROCESS_SNAPSHOT_TTL', 30))
+CGROUP_DIR = '/sys/fs/cgroup'
+# Seconds the running containers are reused for when none started or
+# stopped in the meantime.
+CONTAINER_DISCOVERY_TTL = int(os.environ.get('MAAS_CONTAINER_DISCOVERY_TTL',
+                                             300))
 
 
 NEUTRON_AGENT_TYPE_LIST = [
@@ -82,24 +104,41 @@ NOVA_SERVICE_TYPE_LIST = [
 ]
 
 
+def load_auth_details():
+    """Return AUTH_DETAILS with the distribution specific defaults applied.
+
+    The distribution is only looked up once, the first time the
+    authentication details are needed.
+    """
+
+    global _AUTH_DETAILS_LOADED
+    if not _AUTH_DETAILS_LOADED:
+        import distro
+
+        if 'Ubuntu' in distro.name():
+            AUTH_DETAILS.update(UBUNTU_AUTH_DETAILS)
+        _AUTH_DETAILS_LOADED = True
+    return AUTH_DETAILS
+
+
 def build_sdk_connection():
     """
     This function will create a universal connection to OpenStack with
     the OpenStack SDK. It will use the defined configuration from
     /root/.config/openstack/clouds.yaml deployed during
     maas-agent-setup.yml. It will then attempt to load pre-existing
-    credentials into a session. If no credentials are found on disk,
-    the the connection will re-authenticate to OpenStack automatically
-    and pickle the authentication data to disk.
+    credentials into a session. If no valid credentials are found on
+    disk, the connection will re-authenticate to OpenStack and cache
+    the authentication data to disk.
     """
 
+    from openstack import connect
+
     if os.path.exists(OPENRC) or os.path.exists(STACKRC):
-        try:
-            sdk_conn = connect(cloud=AUTH_DETAILS.get('OS_CLOUDNAME'), verify=False)
-        except MissingRequiredOptions as e:
-            raise e
+        cloud = load_auth_details().get('OS_CLOUDNAME')
+        sdk_conn = connect(cloud=cloud, verify=False)
 
-        # Load pre-existing credentials and validate
+        # Load pre-existing credentials or refresh them
         get_sdk_credentials(sdk_conn)
 
     return sdk_conn
@@ -107,46 +146,151 @@ def build_sdk_connection():
 
 def get_sdk_credentials(sdk_conn):
     """
-    Load, validate, and dump credentials for the OpenStack SDK
-    connection.
+    Load the cached credentials for the OpenStack SDK connection,
+    obtaining and caching a new token when required.
 
-    The connection object uses a password adapter, so if the session
-    token loaded is expired, it will obtain a valid token automatically.
+    The expiry of the cached token is read locally, so no keystone
+    request is made until the token is within TOKEN_EXPIRY_MARGIN
+    seconds of expiring. A token revoked before then is still handled,
+    the password plugin re-authenticates when an API call returns 401.
     """
 
+    auth = sdk_conn.session.auth
     try:
-        sdk_conn.session
-        if os.stat(PICKLE_FILE):
-            with open(PICKLE_FILE, "rb") as f:
-                sdk_auth_ref = pickle.load(f)
-
-            if sdk_auth_ref:
-                sdk_conn.session.auth.auth_ref = sdk_auth_ref
-                token = sdk_auth_ref._auth_token
-        else:
-            sdk_auth_ref = None
-            token = None
+        if _load_auth_state(auth):
+            return
+
+        with _file_lock(TOKEN_CACHE_LOCK):
+            # Another check may have refreshed the token while we
+            # were waiting for the lock.
+            if _load_auth_state(auth):
+                return
+            refresh_sdk_token(sdk_conn)
+    except (IOError, OSError) as e:
+        status_err(str(e), m_name='maas_keystone')
+
+
+def refresh_sdk_token(sdk_conn):
+    """
+    Obtain a new token for the connection and atomically replace
+    TOKEN_CACHE_FILE with it. The caller must hold the token cache lock.
+    """
+
+    auth = sdk_conn.session.auth
+    auth.invalidate()
+    sdk_conn.session.get_token()
+
+    data = {'cache_id': auth.get_cache_id(),
+            'auth_state': auth.get_auth_state()}
+    tmp_file = '%s.%d' % (TOKEN_CACHE_FILE, os.getpid())
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp_file, TOKEN_CACHE_FILE)
+
+    try:
+        os.remove(LEGACY_TOKEN_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _load_auth_state(auth):
+    """
+    Load TOKEN_CACHE_FILE into the auth plugin.
 
-        validate_sdk_token(sdk_conn, sdk_auth_ref=sdk_auth_ref, token=token)
-    except OSError as e:
+    Returns True when the cached token belongs to the same credentials
+    and does not expire within TOKEN_EXPIRY_MARGIN seconds.
+    """
+
+    try:
+        with open(TOKEN_CACHE_FILE) as f:
+            data = json.load(f)
+        if data['cache_id'] != auth.get_cache_id():
+            return False
+        auth.set_auth_state(data['auth_state'])
+    except IOError as e:
         if e.errno == errno.ENOENT:
-            validate_sdk_token(sdk_conn, sdk_auth_ref=None)
-        else:
-            status_err(str(e), m_name='maas_keystone')
+            return False
+        raise
+    except (ValueError, KeyError, TypeError):
+        # A corrupt or incompatible cache file is simply replaced.
+        return False
+
+    auth_ref = auth.auth_ref
+    if auth_ref is None:
+        return False
+    return not auth_ref.will_expire_soon(stale_duration=TOKEN_EXPIRY_MARGIN)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Serialise a critical section between concurrently running checks."""
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
 
 
-def validate_sdk_token(sdk_conn, sdk_auth_ref=None, token=None):
+def _cache_path(name):
+    return os.path.join(CACHE_DIR, re.sub(r'[^\w.-]', '_', name))
+
+
+def read_cache(name, ttl=None):
     """
-    Validate the existing session credentials using an inexpensive API
-    call. If the token was determined to be expired, get a new one and
-    dump it to PICKLE_FILE.
+    Return the value cached under name by write_cache, or None when
+    there is no cached value or it is older than ttl seconds.
     """
 
-    [i.id for i in sdk_conn.identity.services()]
-    new_token = sdk_conn.identity.get_token()
-    if token is not new_token or sdk_auth_ref is None:
-        with open(PICKLE_FILE, 'wb') as f:
-            pickle.dump(sdk_conn.session.auth.auth_ref, f)
+    try:
+        with open(_cache_path(name) + '.json') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if ttl is not None and time.time() - data['timestamp'] > ttl:
+        return None
+    return data['value']
+
+
+def write_cache(name, value):
+    """Atomically store a JSON serialisable value under name."""
+
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR, 0o700)
+    path = _cache_path(name) + '.json'
+    tmp_file = '%s.%d' % (path, os.getpid())
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'timestamp': time.time(), 'value': value}, f)
+    os.rename(tmp_file, path)
+
+
+def get_cached(name, ttl, func, *args, **kwargs):
+    """
+    Return func(*args, **kwargs), reusing the result of a previous call
+    made by any check within the last ttl seconds.
+
+    Only one check at a time calls func for a given name, the others wait
+    for it and use its result.
+    """
+
+    if not ttl:
+        return func(*args, **kwargs)
+    value = read_cache(name, ttl)
+    if value is not None:
+        return value
+
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR, 0o700)
+    with _file_lock(_cache_path(name) + '.lock'):
+        value = read_cache(name, ttl)
+        if value is None:
+            value = func(*args, **kwargs)
+            write_cache(name, value)
+    return value
 
 
 def get_openstack_client(component):
@@ -181,8 +325,397 @@ class MaaSException(Exception):
     """Base MaaS plugin exception."""
 
 
+# Largest single JSON array element iter_json_array will buffer.
+JSON_ITEM_MAX_SIZE = 1024 * 1024
+
+
+def iter_json_array(chunks, max_item_size=JSON_ITEM_MAX_SIZE):
+    """Incrementally decode a JSON array, yielding one element at a time.
+
+    ``chunks`` is an iterable of ``bytes`` or ``str``, such as
+    ``response.iter_content()``. Only the element being decoded is kept in
+    memory, so large API listings can be aggregated without loading the
+    whole document. A ``ValueError`` is raised when the document is not an
+    array or an element exceeds ``max_item_size`` characters. Elements are
+    only yielded once the delimiter following them was read, as a chunk
+    may end in the middle of a number.
+    """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    # Whitespace, and once the array is open the separators between items
+    skip = re.compile(r'[ \t\n\r]*')
+    skip_items = re.compile(r'[ \t\n\r,]*')
+    buf = ''
+    started = False
+    finished = False
+    chunks = iter(chunks)
+    while True:
+        chunk = next(chunks, None)
+        if chunk is None:
+            finished = True
+            chunk = utf8.decode(b'', final=True)
+        elif isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk)
+        buf += chunk
+
+        pos = 0
+        if not started:
+            pos = skip.match(buf).end()
+            if pos == len(buf):
+                buf = ''
+                if finished:
+                    raise ValueError('Expected a JSON array')
+                continue
+            if buf[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+
+        while True:
+            pos = skip_items.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if buf[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if finished:
+                    raise
+                break
+            # A number is only complete once the delimiter following it
+            # was read, "1" may be the start of "1.5", "1e3" or "10".
+            delimiter = skip.match(buf, end).end()
+            if delimiter == len(buf) and not finished:
+                break
+            if delimiter < len(buf) and buf[delimiter] not in ',]':
+                if not finished:
+                    break
+                raise ValueError('Expected "," or "]" after a JSON array '
+                                 'element')
+            yield item
+            pos = end
+
+        buf = buf[pos:]
+        if len(buf) > max_item_size:
+            raise ValueError('JSON array element exceeds %d characters'
+                             % max_item_size)
+        if finished:
+            raise ValueError('Unterminated JSON array')
+
+
+# name is the command name of /proc/<pid>/stat, cmdline the basename of
+# every argument joined by spaces and pidns the inode of the PID namespace
+# or None when it cannot be read. container is the LXC container name or
+# the podman or docker container id the process runs in, None on the host.
+Process = collections.namedtuple('Process', ['pid', 'ppid', 'pidns', 'name',
+                                             'cmdline', 'container'])
+
+# Container part of the cgroup path of a process for LXC 4+ (lxc.payload),
+# older LXC, podman and docker. The LXC monitor processes run in
+# lxc.monitor.<name> on the host and are not matched.
+CONTAINER_CGROUP_RE = re.compile(
+    r':/lxc\.payload[./]([^/\n]+)|:/lxc/([^/\n]+)|'
+    r'(?:libpod|docker)[-/]([0-9a-f]{64})')
+
+
+def _cgroup_container(cgroup):
+    match = CONTAINER_CGROUP_RE.search(cgroup)
+    if match:
+        return next(group for group in match.groups() if group)
+    return None
+
+
+def _read_process(pid):
+    base = os.path.join(PROC_DIR, str(pid))
+    with open(os.path.join(base, 'cmdline'), 'rb') as f:
+        data = f.read()
+    if not data:
+        # Kernel threads and zombies have no command line
+        return None
+    data = data.decode('utf-8', 'replace')
+    if data.endswith('\0'):
+        data = data[:-1]
+    args = data.split('\0')
+    if len(args) == 1 and ' ' in data:
+        # Processes which rewrote their title separate it with spaces
+        args = data.split(' ')
+    cmdline = ' '.join(os.path.basename(arg) for arg in args)
+
+    with open(os.path.join(base, 'stat')) as f:
+        stat = f.read()
+    # The command name may contain spaces and parentheses itself
+    name = stat[stat.index('(') + 1:stat.rindex(')')]
+    ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+
+    try:
+        pidns = os.stat(os.path.join(base, 'ns', 'pid')).st_ino
+    except (IOError, OSError):
+        pidns = None
+
+    with open(os.path.join(base, 'cgroup')) as f:
+        container = _cgroup_container(f.read())
+    return Process(pid, ppid, pidns, name, cmdline, container)
+
+
+def process_snapshot(ttl=PROCESS_SNAPSHOT_TTL):
+    """Return a Process for every process on the host from one /proc scan.
+
+    The scan is shared between the checks through the cache, a snapshot
+    taken by any check within the last ttl seconds is reused instead of
+    walking /proc again. The check taking the snapshot and every process
+    running a file of the plugin directory are left out: the checks, their
+    run_plugin_in_venv.sh wrappers, the plugin runner and its clients have
+    the process names they look for in their command lines.
+    """
+
+    processes = get_cached('process_snapshot', ttl, _scan_processes)
+    return [Process(*process) for process in processes]
+
+
+def _plugin_files():
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        names = os.listdir(plugin_dir)
+    except (IOError, OSError):
+        names = []
+    plugins = [name for name in names if name.endswith('.py')]
+    return frozenset(plugins + ['run_plugin_in_venv.sh'])
+
+
+def _scan_processes():
+    plugin_files = _plugin_files()
+    processes = []
+    for entry in os.listdir(PROC_DIR):
+        if not entry.isdigit() or int(entry) == os.getpid():
+            continue
+        try:
+            process = _read_process(int(entry))
+        except (IOError, OSError, ValueError, IndexError):
+            # The process exited while it was being read
+            continue
+        if process and plugin_files.isdisjoint(process.cmdline.split(' ')):
+            processes.append(process)
+    return processes
+
+
+def _container_runtime_names():
+    """Map the podman and docker container ids to their names.
+
+    The names are read from the state the runtimes keep on disk rather than
+    by running podman or docker.
+    """
+
+    names = dict()
+    try:
+        with open(PODMAN_CONTAINERS_FILE) as f:
+            for container in json.load(f):
+                if container.get('names'):
+                    names[container['id']] = container['names'][0]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    try:
+        container_ids = os.listdir(DOCKER_CONTAINERS_DIR)
+    except (IOError, OSError):
+        container_ids = []
+    for container_id in container_ids:
+        config = os.path.join(DOCKER_CONTAINERS_DIR, container_id,
+                              'config.v2.json')
+        try:
+            with open(config) as f:
+                names[container_id] = json.load(f)['Name'].lstrip('/')
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            pass
+    return names
+
+
+def processes_by_container(processes):
+    """Group the processes of a snapshot by the container they run in.
+
+    Membership comes from the cgroup of each process, so every process of
+    a container is found and not only the children of its init, and every
+    LXC, podman and docker container is covered by the same scan. The
+    containers are keyed by name, podman and docker containers whose name
+    is unknown by id.
+    """
+
+    containers = collections.defaultdict(list)
+    for process in processes:
+        if process.container:
+            containers[process.container].append(process)
+
+    if any(re.match(r'[0-9a-f]{64}$', key) for key in containers):
+        names = _container_runtime_names()
+        for container_id in list(containers):
+            if container_id in names:
+                containers[names[container_id]].extend(
+                    containers.pop(container_id))
+    return dict(containers)
+
+
+def find_processes(names, processes, exclude=None):
+    """Return the subset of names found in the command line of a process.
+
+    A name is found when it is a substring of the command line of any of
+    the processes, as with ``name in cmdline``. All the command lines are
+    joined into one string so each name is looked up with a single search
+    instead of a loop over every process. Command lines containing exclude
+    are ignored.
+    """
+
+    text = '\0'.join(p.cmdline for p in processes
+                     if not exclude or exclude not in p.cmdline)
+    return set(name for name in names if name in text)
+
+
+# Cgroup directories, relative to the cgroup root, in which the containers
+# get a cgroup named after them: LXC 4+ and older LXC, docker and podman
+# with the systemd or the cgroupfs cgroup manager.
+CONTAINER_CGROUP_PARENTS = (
+    ('', re.compile(r'lxc\.payload\.(.+)$'), 'lxc'),
+    ('lxc.payload', re.compile(r'(.+)$'), 'lxc'),
+    ('lxc', re.compile(r'(.+)$'), 'lxc'),
+    ('system.slice', re.compile(r'docker-([0-9a-f]{64})\.scope$'), 'docker'),
+    ('docker', re.compile(r'([0-9a-f]{64})$'), 'docker'),
+    ('machine.slice', re.compile(r'libpod-([0-9a-f]{64})\.scope$'), 'podman'),
+    ('libpod_parent', re.compile(r'libpod-([0-9a-f]{64})$'), 'podman'),
+)
+
+# Service roles and the names of the containers running them, the first
+# running container in name order is used for a role.
+CONTAINER_ROLES = {
+    'ceph_mon': r'ceph[-_]mon',
+    'galera': r'galera',
+    'swift': r'swift',
+    'swift_proxy': r'swift_proxy',
+}
+
+# runtime is lxc, docker or podman, id the name of the container for LXC
+# and pid its lowest process id, usually the one of its init.
+Container = collections.namedtuple('Container', ['name', 'runtime', 'id',
+                                                 'pid'])
+
+
+def _cgroup_root():
+    # The unified hierarchy of cgroup v2, or the pids controller of v1
+    if os.path.exists(os.path.join(CGROUP_DIR, 'cgroup.controllers')):
+        return CGROUP_DIR
+    for controller in ('pids', 'systemd'):
+        path = os.path.join(CGROUP_DIR, controller)
+        if os.path.isdir(path):
+            return path
+    return CGROUP_DIR
+
+
+def _container_cgroups():
+    """Return [runtime, id, path, inode] of every container cgroup.
+
+    The inode of a cgroup directory changes when the container is
+    restarted, so the list changes whenever a container starts or stops.
+    """
+
+    root = _cgroup_root()
+    cgroups = []
+    for parent, pattern, runtime in CONTAINER_CGROUP_PARENTS:
+        parent = os.path.join(root, parent)
+        try:
+            entries = os.listdir(parent)
+        except (IOError, OSError):
+            continue
+        for entry in entries:
+            match = pattern.match(entry)
+            path = os.path.join(parent, entry)
+            if not match or not os.path.isdir(path):
+                continue
+            try:
+                inode = os.stat(path).st_ino
+            except (IOError, OSError):
+                continue
+            cgroups.append([runtime, match.group(1), path, inode])
+    return sorted(cgroups)
+
+
+def _cgroup_pid(path):
+    """Return the lowest pid of a cgroup and the cgroups below it."""
+
+    pids = []
+    for dirpath, _, filenames in os.walk(path):
+        if 'cgroup.procs' not in filenames:
+            continue
+        try:
+            with open(os.path.join(dirpath, 'cgroup.procs')) as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        except (IOError, OSError, ValueError):
+            continue
+    return min(pids) if pids else None
+
+
+def _resolve_containers(cgroups):
+    names = dict()
+    if any(runtime != 'lxc' for runtime, _, _, _ in cgroups):
+        names = _container_runtime_names()
+
+    containers = []
+    for runtime, container_id, path, _ in cgroups:
+        pid = _cgroup_pid(path)
+        # Cgroups of stopped containers may be left behind empty
+        if pid is not None:
+            name = names.get(container_id, container_id)
+            containers.append([name, runtime, container_id, pid])
+    return containers
+
+
+def running_containers(ttl=CONTAINER_DISCOVERY_TTL):
+    """Return {name: Container} of the running LXC, docker and podman
+    containers.
+
+    The containers are found from their cgroup under /sys/fs/cgroup and
+    named from the state the runtimes keep on disk, no lxc-ls, docker or
+    podman command is run. The result is shared by the checks through the
+    cache for ttl seconds, and found again as soon as a container starts
+    or stops as the cgroup directories are listed on every call.
+    """
+
+    cgroups = _container_cgroups()
+    cached = read_cache('containers', ttl) if ttl else None
+    if cached is None or cached['cgroups'] != cgroups:
+        cached = {'cgroups': cgroups,
+                  'containers': _resolve_containers(cgroups)}
+        if ttl:
+            write_cache('containers', cached)
+    return dict((container[0], Container(*container))
+                for container in cached['containers'])
+
+
+def find_containers(role, ttl=CONTAINER_DISCOVERY_TTL):
+    """Return the running containers of a role of CONTAINER_ROLES, or whose
+    name matches the role as a pattern, in name order."""
+
+    pattern = re.compile(CONTAINER_ROLES.get(role, role))
+    containers = running_containers(ttl)
+    return [containers[name] for name in sorted(containers)
+            if pattern.search(name)]
+
+
+def find_container(role, ttl=CONTAINER_DISCOVERY_TTL):
+    """Return the first running container of a role, None if there is
+    none."""
+
+    containers = find_containers(role, ttl)
+    return containers[0] if containers else None
+
+
+def container_path(container, path):
+    """Return the path to path in the filesystem of a running container."""
+
+    return os.path.join(PROC_DIR, str(container.pid), 'root',
+                        path.lstrip('/'))
+
+
 def get_auth_details(openrc_file=OPENRC):
-    auth_details = AUTH_DETAILS
+    auth_details = load_auth_details()
     pattern = re.compile(
         '^(?:export\s)?(?P<key>\w+)(?:\s+)?=(?:\s+)?(?P<value>.*)$'
     )
@@ -224,6 +757,9 @@ def get_auth_details(openrc_file=OPENRC):
 
 STATUS = ''
 METRICS = list()
+# Metrics the agent accepts from a single check.
+MAX_METRICS = 50
+SAMPLES = None
 TELEGRAF_ENABLED = False
 TELEGRAF_METRICS = {
     'variables': dict(),
@@ -299,8 +835,9 @@ def metric(name, metric_type, value, unit=None, m_name=None):
     if 'measurement_name' not in TELEGRAF_METRICS:
         _telegraf_metric_name(name=name, m_name=m_name)
 
-    if len(METRICS) > 49:
-        status_err('Maximum of 50 metrics per check', m_name='maas')
+    if len(METRICS) >= MAX_METRICS:
+        status_err('Maximum of %d metrics per check' % MAX_METRICS,
+                   m_name='maas')
 
     metric_line = 'metric %s %s %s' % (name, metric_type, value)
     if unit is not None:
@@ -317,6 +854,106 @@ def metric_bool(name, success, m_name=None):
     metric(name, 'uint32', value, m_name=m_name)
 
 
+def _samples_name():
+    """Name of the sample store of the running check.
+
+    The same plugin is often run by several checks with different
+    arguments, each of them gets its own store.
+    """
+    import hashlib
+
+    plugin = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    args = hashlib.sha256(' '.join(sys.argv[1:]).encode('utf-8')).hexdigest()
+    return 'samples_%s_%s' % (plugin, args[:12])
+
+
+def _load_samples():
+    global SAMPLES
+    if SAMPLES is None:
+        SAMPLES = read_cache(_samples_name())
+        if not isinstance(SAMPLES, dict):
+            SAMPLES = dict()
+    return SAMPLES
+
+
+def _save_samples():
+    if SAMPLES is None:
+        return
+    now = time.time()
+    samples = dict((key, sample) for key, sample in SAMPLES.items()
+                   if now - sample[0] < SAMPLE_EXPIRY)
+    try:
+        write_cache(_samples_name(), samples)
+    except (IOError, OSError) as e:
+        logging.error('Unable to save the counter samples of %s: %s',
+                      sys.argv[0], e)
+
+
+def _counter_value(value):
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def sample_delta(key, value):
+    """
+    Return the increase of the counter key since the previous run of the
+    check, and the number of seconds elapsed, as a (delta, elapsed) tuple.
+
+    (None, None) is returned the first time a counter is seen. A counter
+    lower than its previous sample is assumed to have been reset, for
+    example by a service restart, and to have started again from zero.
+    The samples are saved when the print_output block exits.
+    """
+
+    samples = _load_samples()
+    value = _counter_value(value)
+    now = time.time()
+    previous = samples.get(key)
+    samples[key] = [now, value]
+    if not previous or now <= previous[0]:
+        return None, None
+    if value < previous[1]:
+        return value, now - previous[0]
+    return value - previous[1], now - previous[0]
+
+
+def sample_rate(key, value):
+    """Return the per second rate of the counter key, see sample_delta."""
+
+    delta, elapsed = sample_delta(key, value)
+    if delta is None:
+        return None
+    return delta / float(elapsed)
+
+
+def metric_delta(name, metric_type, value, unit=None, m_name=None):
+    """
+    Emit the increase of a monotonically increasing counter since the
+    previous run instead of its raw value. Nothing is emitted the first
+    time the counter is seen.
+    """
+
+    delta, _ = sample_delta(name, value)
+    if delta is not None:
+        metric(name, metric_type, delta, unit, m_name=m_name)
+
+
+def metric_rate(name, value, unit=None, m_name=None):
+    """
+    Emit the per second rate of a monotonically increasing counter since
+    the previous run instead of its raw value. Nothing is emitted the
+    first time the counter is seen.
+    """
+
+    rate = sample_rate(name, value)
+    if rate is not None:
+        metric(name, 'double', round(rate, 3), unit, m_name=m_name)
+
+
 try:
     logging.basicConfig(filename='/var/log/maas_plugins.log',
                         format='%(asctime)s %(levelname)s: %(message)s')
@@ -326,6 +963,13 @@ except IOError as e:
                   e)
 
 
+def _write_telegraf():
+    from monitorstack.common import formatters
+
+    TELEGRAF_METRICS['message'] = STATUS
+    formatters.write_telegraf(TELEGRAF_METRICS)
+
+
 @contextlib.contextmanager
 def print_output(print_telegraf=False):
     if print_telegraf:
@@ -335,8 +979,7 @@ def print_output(print_telegraf=False):
         yield
     except SystemExit as e:
         if print_telegraf:
-            TELEGRAF_METRICS['message'] = STATUS
-            formatters.write_telegraf(TELEGRAF_METRICS)
+            _write_telegraf()
         else:
             if STATUS:
                 print(STATUS)
@@ -348,10 +991,11 @@ def print_output(print_telegraf=False):
                    m_name='maas')
     else:
         if print_telegraf:
-            TELEGRAF_METRICS['message'] = STATUS
-            formatters.write_telegraf(TELEGRAF_METRICS)
+            _write_telegraf()
         else:
             if STATUS:
                 print(STATUS)
             for metric in METRICS:
                 print(metric)
+    finally:
+        _save_samples()
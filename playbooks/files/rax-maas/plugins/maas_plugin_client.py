@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Copyright 2026, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Thin client for maas_plugin_runner.py.
+
+Usage is the same as running the plugin directly::
+
+    maas_plugin_client.py <plugin> [plugin args]
+
+The plugin is handed to the runner over its unix socket and the status and
+metric lines it produced are printed back. When the runner cannot be
+reached, or turns the request down, the plugin is executed in a new
+interpreter instead, so checks never depend on the runner being up. Once
+the runner has accepted a request the plugin is never run a second time,
+a runner failing from then on is reported as the status of the check.
+Only the standard library is imported here to keep the start up cost of
+the client low.
+"""
+
+import json
+import os
+import socket
+import sys
+
+
+SOCKET_PATH = os.environ.get('MAAS_PLUGIN_RUNNER_SOCKET',
+                             '/run/maas-plugin-runner.sock')
+CONNECT_TIMEOUT = 2
+
+
+def status_err(message):
+    # Same status line as maas_common.status_err, without importing it.
+    print('status error maas_plugin_client: %s' % message)
+    sys.stdout.flush()
+    sys.exit(1)
+
+
+def run_local(argv):
+    try:
+        os.execv(sys.executable, [sys.executable] + argv)
+    except OSError as e:
+        status_err('Unable to run %s: %s' % (argv[0], e))
+
+
+def send_request(argv):
+    """Connect to the runner and send it the request for the plugin."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    sock.connect(SOCKET_PATH)
+    # The agent enforces the check timeout by killing this process.
+    sock.settimeout(None)
+    request = {'argv': [os.path.abspath(argv[0])] + argv[1:],
+               'env': dict(os.environ),
+               'cwd': os.getcwd()}
+    sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+    return sock
+
+
+def read_reply(sock):
+    with sock:
+        data = b''
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    if not data:
+        raise IOError('No reply from the plugin runner')
+    return json.loads(data.decode('utf-8'))
+
+
+def main(argv):
+    if not argv:
+        sys.exit('usage: %s <plugin> [args]' % sys.argv[0])
+
+    try:
+        sock = send_request(argv)
+    except (IOError, OSError):
+        run_local(argv)
+
+    # The runner may already have run the plugin, running it again could
+    # repeat whatever it did, so failures are reported instead.
+    try:
+        reply = read_reply(sock)
+    except (IOError, OSError, ValueError) as e:
+        status_err('Plugin runner failed: %s' % e)
+    if reply.get('rejected'):
+        run_local(argv)
+
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.exit(reply['rc'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+# Copyright 2026, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long lived runner for the MaaS agent plugins.
+
+Every agent.plugin check used to start a fresh interpreter which then
+imported maas_common and the OpenStack SDK again. The runner imports the
+plugin dependencies once, listens on a unix socket and forks a worker from
+the warm parent for every request. The worker executes the plugin exactly
+as ``python <plugin> <args>`` would, so each check still runs in its own
+process with its own copy of the maas_common state, and the captured output
+is handed back to maas_plugin_client.py.
+"""
+
+import argparse
+import ast
+import builtins
+import errno
+import glob
+import importlib
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import traceback
+
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+SOCKET_PATH = '/run/maas-plugin-runner.sock'
+# Requests are a single json document, anything bigger is not one of ours.
+MAX_REQUEST_SIZE = 1024 * 1024
+
+LOG = logging.getLogger('maas_plugin_runner')
+
+
+class PluginRunner(object):
+    def __init__(self, plugin_dir=PLUGIN_DIR, socket_path=SOCKET_PATH,
+                 timeout=899, max_workers=64):
+        self.plugin_dir = os.path.realpath(plugin_dir)
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.workers = set()
+        self.code_cache = dict()
+        self.sock = None
+
+    def preload(self):
+        """Import the dependencies of every plugin in the plugin dir."""
+        for path in sorted(glob.glob(os.path.join(self.plugin_dir, '*.py'))):
+            if os.path.realpath(path) == os.path.realpath(__file__):
+                continue
+            try:
+                self.get_code(path)
+            except Exception:
+                LOG.exception('Unable to preload plugin %s', path)
+
+    def get_code(self, path):
+        """Return the compiled plugin, compiling it when it has changed.
+
+        The first time a plugin is seen the modules it imports at the top
+        level are imported into the runner so forked workers find them in
+        sys.modules instead of importing them again.
+        """
+        mtime = os.stat(path).st_mtime
+        cached = self.code_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'rb') as f:
+            source = f.read()
+        tree = ast.parse(source, filename=path)
+        for name in _top_level_imports(tree):
+            try:
+                importlib.import_module(name)
+            except Exception:
+                # Plugins guard optional modules themselves, the import
+                # will be retried (and reported) by the worker.
+                LOG.debug('Unable to preload module %s for %s', name, path)
+        code = compile(tree, path, 'exec')
+        self.code_cache[path] = (mtime, code)
+        return code
+
+    def resolve(self, plugin):
+        path = os.path.realpath(os.path.join(self.plugin_dir, plugin))
+        if os.path.dirname(path) != self.plugin_dir:
+            raise ValueError('%s is not a plugin in %s'
+                             % (plugin, self.plugin_dir))
+        if not os.path.isfile(path):
+            raise ValueError('%s does not exist' % path)
+        return path
+
+    def listen(self):
+        try:
+            os.unlink(self.socket_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self.sock.listen(128)
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    self.workers.clear()
+                    return
+                raise
+            if pid == 0:
+                return
+            self.workers.discard(pid)
+
+    def serve_forever(self):
+        self.listen()
+        LOG.info('Listening on %s', self.socket_path)
+        while True:
+            self.reap()
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 1.0)
+            except InterruptedError:
+                continue
+            if not readable:
+                continue
+            conn, _ = self.sock.accept()
+            try:
+                self.handle(conn)
+            except Exception:
+                LOG.exception('Unable to handle plugin request')
+            finally:
+                conn.close()
+
+    def handle(self, conn):
+        # Rejected requests make the client fall back to running the plugin
+        # itself, which also reports the errors of plugins unfit to run.
+        if len(self.workers) >= self.max_workers:
+            LOG.warning('Too many running checks (%d), rejecting request',
+                        len(self.workers))
+            _reject(conn)
+            return
+
+        try:
+            request = json.loads(_recv_request(conn))
+            argv = request['argv']
+            path = self.resolve(argv[0])
+            code = self.get_code(path)
+        except Exception:
+            LOG.exception('Unable to prepare plugin request, rejecting it')
+            _reject(conn)
+            return
+
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+
+        # Worker process
+        rc = 1
+        try:
+            self.sock.close()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            rc = self.run_check(conn, request, path, code)
+        except BaseException:
+            LOG.exception('Plugin worker for %s failed', path)
+        finally:
+            os._exit(rc)
+
+    def run_check(self, conn, request, path, code):
+        os.environ.clear()
+        os.environ.update(request.get('env', {}))
+        os.chdir(request.get('cwd') or '/')
+        sys.argv = [path] + list(request['argv'][1:])
+        # maas_common reads settings such as MAAS_CACHE_DIR from the
+        # environment when imported, importing it again applies the ones of
+        # the check and gives the plugin the state of a fresh import.
+        maas_common = sys.modules.get('maas_common')
+        if maas_common is not None:
+            importlib.reload(maas_common)
+
+        # Redirect the real file descriptors so anything written by the
+        # plugin, including from subprocesses, ends up in the reply.
+        stdout = tempfile.TemporaryFile()
+        stderr = tempfile.TemporaryFile()
+        os.dup2(stdout.fileno(), 1)
+        os.dup2(stderr.fileno(), 2)
+        sys.stdout = open(1, 'w', closefd=False)
+        sys.stderr = open(2, 'w', closefd=False)
+
+        # The agent enforces the timeout of each check by killing the
+        # client, the runner timeout only bounds checks whose client is
+        # stuck rather than gone.
+        watcher = threading.Thread(target=_watch_client, args=(conn,))
+        watcher.daemon = True
+        watcher.start()
+        signal.signal(signal.SIGALRM, _timeout_handler)
+        signal.alarm(self.timeout)
+        try:
+            exec(code, {'__name__': '__main__',
+                        '__file__': path,
+                        '__builtins__': builtins})
+        except SystemExit as e:
+            rc = _exit_code(e.code)
+        except BaseException:
+            traceback.print_exc()
+            rc = 1
+        else:
+            rc = 0
+        finally:
+            signal.alarm(0)
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+        reply = {'rc': rc,
+                 'stdout': _read_all(stdout),
+                 'stderr': _read_all(stderr)}
+        conn.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+        return rc
+
+
+class CheckTimeout(Exception):
+    pass
+
+
+def _timeout_handler(signum, frame):
+    raise CheckTimeout('Plugin did not complete within the runner timeout')
+
+
+def _watch_client(conn):
+    """Abort the worker once the client of the check has gone away.
+
+    Nothing is sent by the client after its request, the connection only
+    becomes readable again when it is closed.
+    """
+    try:
+        while conn.recv(1):
+            pass
+    except (IOError, OSError):
+        pass
+    os._exit(1)
+
+
+def _exit_code(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _reject(conn):
+    conn.sendall(json.dumps({'rejected': True}).encode('utf-8') + b'\n')
+
+
+def _read_all(f):
+    f.seek(0)
+    return f.read().decode('utf-8', 'replace')
+
+
+def _recv_request(conn):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_REQUEST_SIZE:
+            raise ValueError('Request exceeds %d bytes' % MAX_REQUEST_SIZE)
+    return data.decode('utf-8')
+
+
+def _top_level_imports(tree):
+    """Yield the absolute module names imported by a module body.
+
+    Imports nested in try blocks are included, imports inside functions are
+    not, as they are deliberately deferred by the plugin.
+    """
+    for node in tree.body:
+        nodes = [node]
+        if isinstance(node, ast.Try):
+            nodes = node.body + [n for h in node.handlers for n in h.body]
+        for n in nodes:
+            if isinstance(n, ast.Import):
+                for alias in n.names:
+                    yield alias.name
+            elif isinstance(n, ast.ImportFrom) and not n.level:
+                yield n.module
+
+
+def main(args):
+    runner = PluginRunner(plugin_dir=args.plugin_dir,
+                          socket_path=args.socket,
+                          timeout=args.timeout,
+                          max_workers=args.max_workers)
+    if args.preload:
+        runner.preload()
+
+    def _shutdown(signum, frame):
+        try:
+            os.unlink(runner.socket_path)
+        except OSError:
+            pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    runner.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run MaaS plugins from a long lived process')
+    parser.add_argument('--socket',
+                        default=SOCKET_PATH,
+                        help='Unix socket to listen on')
+    parser.add_argument('--plugin-dir',
+                        default=PLUGIN_DIR,
+                        help='Directory containing the MaaS plugins')
+    parser.add_argument('--timeout',
+                        type=int,
+                        default=899,
+                        help='Seconds after which a running check is aborted '
+                             'when its client is still connected')
+    parser.add_argument('--max-workers',
+                        type=int,
+                        default=64,
+                        help='Maximum number of checks running at once')
+    parser.add_argument('--no-preload',
+                        dest='preload',
+                        action='store_false',
+                        default=True,
+                        help='Do not import plugin dependencies on start')
+    args = parser.parse_args()
+    # Only configure our own logger, the root logger is left for
+    # maas_common to point at /var/log/maas_plugins.log.
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+    LOG.addHandler(handler)
+    LOG.setLevel(logging.INFO)
+    LOG.propagate = False
+    main(args)
@@ -19,6 +19,7 @@ import psutil
 
 from maas_common import metric
 from maas_common import print_output
+from maas_common import process_snapshot
 from maas_common import status_err
 from maas_common import status_ok
 
@@ -31,7 +32,17 @@ def _get_poller_proc(name="rackspace-monitoring-poller"):
 
     Returns None when more than one poller is found.
     """
-    procs = list(filter(lambda proc: proc.name() == name, psutil.process_iter()))
+    # The command name is truncated to 15 characters so, as psutil does,
+    # the program name is taken from the command line instead.
+    procs = []
+    for proc in process_snapshot():
+        if proc.cmdline.split(' ', 1)[0] != name:
+            continue
+        try:
+            procs.append(psutil.Process(proc.pid))
+        except psutil.NoSuchProcess:
+            # The snapshot may be a few seconds old
+            pass
 
     metric_name = "maas_poller"
 
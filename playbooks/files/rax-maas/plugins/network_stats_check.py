@@ -15,44 +15,146 @@
 # limitations under the License.
 
 import argparse
+import array
 import os
 
 from maas_common import metric
 from maas_common import print_output
+from maas_common import sample_rate
 from maas_common import status_err
 from maas_common import status_ok
 
 
-def physical_interface_errors():
-    vnet_devices = os.listdir('/sys/devices/virtual/net')
-    vnet_devices.append('bonding_masters')
+NET_DEV = '/proc/net/dev'
+SOFTNET_STAT = '/proc/net/softnet_stat'
+VIRTUAL_NET = '/sys/devices/virtual/net'
+# Positions of the counters in the rows of /proc/net/dev
+RX_ERRORS = 2
+RX_DROPPED = 3
+TX_ERRORS = 10
+TX_DROPPED = 11
+INTERFACE_COUNTERS = (('rx_errors', RX_ERRORS), ('rx_dropped', RX_DROPPED),
+                      ('tx_errors', TX_ERRORS), ('tx_dropped', TX_DROPPED))
+# Each rank adds a CPU and an interface, eight metrics on top of the seven
+# totals, which stays within maas_common.MAX_METRICS.
+MAX_TOP = 5
+
+
+def read_interface_stats(path=NET_DEV):
+    """Return the counters of every physical interface.
+
+    /proc/net/dev is read once and each interface is parsed into an array
+    of its 16 counters, see the *_ERRORS and *_DROPPED positions.
+    """
+    virtual = set(os.listdir(VIRTUAL_NET))
+    stats = dict()
+    with open(path) as f:
+        # The first two lines are headers
+        lines = f.read().splitlines()[2:]
+    for line in lines:
+        name, counters = line.split(':', 1)
+        name = name.strip()
+        if name not in virtual:
+            stats[name] = array.array('Q', map(int, counters.split()[:16]))
+    return stats
+
+
+def read_softnet_stats(path=SOFTNET_STAT):
+    """Return the (cpu, dropped, time_squeeze) counters of every CPU.
+
+    /proc/net/softnet_stat has a row of hexadecimal counters per online
+    CPU. Recent kernels give the CPU number in the 13th column, otherwise
+    it is the row number.
+    """
+    softnet = []
+    with open(path) as f:
+        lines = f.read().splitlines()
+    for row, line in enumerate(lines):
+        fields = line.split()
+        cpu = int(fields[12], 16) if len(fields) > 12 else row
+        softnet.append((cpu, int(fields[1], 16), int(fields[2], 16)))
+    return softnet
+
+
+def physical_interface_errors(interfaces):
     totals = dict()
-    totals['rx_errors'] = 0
-    totals['tx_errors'] = 0
-    for d in os.listdir('/sys/class/net'):
-        if d not in vnet_devices:
-            for e in 'rx_errors', 'tx_errors':
-                filepath = '/sys/class/net/%s/statistics/%s' % (d, e)
-                with open(filepath, 'r') as f:
-                    totals[e] += int(f.read())
-                    f.close()
+    for name, position in INTERFACE_COUNTERS:
+        totals[name] = sum(c[position] for c in interfaces.values())
     return totals
 
 
-def get_softnet_stats():
+def get_softnet_stats(softnet):
     softnet_stats = dict()
-    softnet_stats['packet_drop'] = 0
-    softnet_stats['time_squeeze'] = 0
-    with open('/proc/net/softnet_stat', 'r') as f:
-        for line in f:
-            softnet_stats['packet_drop'] += int(line.split()[1], 16)
-            softnet_stats['time_squeeze'] += int(line.split()[2], 16)
+    softnet_stats['packet_drop'] = sum(row[1] for row in softnet)
+    softnet_stats['time_squeeze'] = sum(row[2] for row in softnet)
     return softnet_stats
 
 
+def interface_rates(interfaces):
+    """Return the per second error and drop rates of every interface,
+    or an empty list on the first run."""
+    rates = []
+    for name in sorted(interfaces):
+        counters = interfaces[name]
+        rate = dict((counter, sample_rate('interface_%s_%s' % (name, counter),
+                                          counters[position]))
+                    for counter, position in INTERFACE_COUNTERS)
+        if None not in rate.values():
+            rates.append((name, rate))
+    return rates
+
+
+def softnet_rates(softnet):
+    """Return the per second drop and squeeze rates of every CPU, or an
+    empty list on the first run."""
+    rates = []
+    for cpu, dropped, squeezed in softnet:
+        drop_rate = sample_rate('softnet_cpu%d_packet_drop' % cpu,
+                                dropped)
+        squeeze_rate = sample_rate('softnet_cpu%d_time_squeeze' % cpu,
+                                   squeezed)
+        if drop_rate is not None and squeeze_rate is not None:
+            rates.append((cpu, drop_rate, squeeze_rate))
+    return rates
+
+
+def report(interfaces, softnet, top):
+    for k, v in physical_interface_errors(interfaces).items():
+        metric('physical_interface_%s' % k, 'int64', v)
+    for k, v in get_softnet_stats(softnet).items():
+        metric('softnet_stats_%s' % k, 'int64', v)
+
+    cpus = softnet_rates(softnet)
+    if cpus:
+        # A CPU which had to stop processing packets before its backlog
+        # was empty is saturated.
+        metric('softnet_stats_saturated_cpus', 'uint32',
+               len([cpu for cpu in cpus if cpu[2] > 0]))
+        busiest = sorted(cpus, key=lambda c: (-c[2], -c[1], c[0]))[:top]
+        for rank, (cpu, drop_rate, squeeze_rate) in enumerate(busiest, 1):
+            metric('softnet_top_%d_cpu' % rank, 'uint32', cpu)
+            metric('softnet_top_%d_packet_drop_rate' % rank, 'double',
+                   round(drop_rate, 3), 'packets_per_second')
+            metric('softnet_top_%d_time_squeeze_rate' % rank, 'double',
+                   round(squeeze_rate, 3), 'squeezes_per_second')
+
+    ifaces = interface_rates(interfaces)
+    worst = sorted(ifaces, key=lambda i: (-sum(i[1].values()), i[0]))[:top]
+    for rank, (name, rate) in enumerate(worst, 1):
+        metric('interface_top_%d_name' % rank, 'string', name)
+        for counter, _ in INTERFACE_COUNTERS:
+            metric('interface_top_%d_%s_rate' % (rank, counter), 'double',
+                   round(rate[counter], 3), 'packets_per_second')
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Network error statistics '
                                      'check')
+    parser.add_argument('--top', type=int, default=3,
+                        choices=range(MAX_TOP + 1),
+                        metavar='{0-%d}' % MAX_TOP,
+                        help='Number of CPUs and interfaces reported by '
+                             'packet drops and errors')
     parser.add_argument('--telegraf-output',
                         action='store_true',
                         default=False,
@@ -60,13 +162,10 @@ if __name__ == '__main__':
     args = parser.parse_args()
     with print_output(print_telegraf=args.telegraf_output):
         try:
-            totals = physical_interface_errors()
-            softnet_stats = get_softnet_stats()
+            interfaces = read_interface_stats()
+            softnet = read_softnet_stats()
         except Exception as e:
             status_err(e, m_name='maas_network_stats')
         else:
             status_ok(m_name='maas_network_stats')
-            for k, v in totals.items():
-                metric('physical_interface_%s' % k, 'int64', v)
-            for k, v in softnet_stats.items():
-                metric('softnet_stats_%s' % k, 'int64', v)
+            report(interfaces, softnet, args.top)
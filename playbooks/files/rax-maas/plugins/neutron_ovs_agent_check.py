@@ -24,58 +24,33 @@ except ImportError:
     import socket
     on_lxc_container = False
 
+from maas_common import find_processes
 from maas_common import get_openstack_client
 from maas_common import metric
 from maas_common import metric_bool
 from maas_common import print_output
+from maas_common import process_snapshot
+from maas_common import processes_by_container
 from maas_common import status_err, status_err_no_exit, status_ok
-from process_check_host import get_processes
 
 
 def check_process_statuses(container_or_host_name, container=None):
     process_names = ['ovsdb-server', 'ovs-vswitchd']
 
-    if container is None:
-        pid = None
-    else:
-        pid = container.init_pid
-
     # Get processes within the neutron container or baremetal host
-    procs = get_processes(parent_pid=pid)
-
-    # Make a list of command lines from each PID. There's a chance that
-    # one or more PIDs may have exited already which results in a
-    # NoSuchProcess exception.
-    cmdlines = []
-    for proc in procs:
-        try:
-            # In psutil 1.2.1, cmdline is an attribute, but in
-            # 5.x, it's now a callable method.
-            cmdline_check = getattr(proc, "cmdline", None)
-            if callable(cmdline_check):
-                cmdline_check_value = proc.cmdline()
-            else:
-                cmdline_check_value = proc.cmdline
-            cmdlines.append(cmdline_check_value)
-        except Exception as e:
-            status_err_no_exit('Error while retrieving process %s, ERROR: %s'
-                               % (cmdline_check_value, str(e)),
-                               m_name='maas_neutron')
-
-    # Loop through the process names provided on the command line to
-    # see if ovsdb-server, ovs-vswitchd exist on the system or in a
+    procs = process_snapshot()
+    if container is not None:
+        procs = processes_by_container(procs).get(container_or_host_name, [])
+
+    # Look for ovsdb-server, ovs-vswitchd on the system or in a
     # container.
+    found = find_processes(process_names, procs)
     pattern = re.compile('[^-\w]+')
     for process_name in process_names:
-        cur_proc_count = 0
-        for cmdline in cmdlines:
-            if process_name in cmdline:
-                cur_proc_count = cur_proc_count + 1
-
         metric_bool('%s_process_status' % (
                     pattern.sub('', process_name)
                     ),
-                    cur_proc_count > 0)
+                    process_name in found)
 
 
 def check(args):
@@ -15,52 +15,97 @@
 # limitations under the License.
 
 import argparse
-import shlex
+import concurrent.futures
 import subprocess
+import time
 
+from maas_common import MAX_METRICS
+from maas_common import metric
 from maas_common import metric_bool
 from maas_common import print_output
 from maas_common import status_err
 from maas_common import status_ok
 
 
-def nfs_export_check():
-    nfs_metrics = dict()
+MOUNTS = '/proc/mounts'
+# Seconds a server is given to list its exports before it is reported
+# offline.
+PROBE_TIMEOUT = 10
+
+
+def nfs_servers(path=MOUNTS):
+    """Return the servers of the NFS mounts with their mount points."""
+    servers = dict()
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3 or fields[2] != 'nfs':
+                continue
+            # server:/export, with IPv6 addresses in brackets
+            server = fields[0].rsplit(':/', 1)[0]
+            servers.setdefault(server, []).append(fields[1])
+    return servers
 
-    output = subprocess.check_output(
-        shlex.split(
-            "awk -F':' '/ nfs / {print $1}' /proc/mounts"
+
+def probe(server, timeout=PROBE_TIMEOUT):
+    """Return the number of exports of server and the time taken in ms.
+
+    A server which fails or does not answer within timeout seconds has no
+    exports.
+    """
+    start = time.time()
+    try:
+        exports = subprocess.check_output(
+            ['showmount', '--no-headers', '--exports', server.strip('[]')],
+            stderr=subprocess.DEVNULL,
+            timeout=timeout
         )
-    ).decode('utf-8')
-    nfs_mounts = output.splitlines()
-    for mount in nfs_mounts:
-        mount_metrics = nfs_metrics[mount] = {'exports': 0, 'online': False}
-        try:
-            exports = subprocess.check_output(
-                shlex.split(
-                    "showmount --no-headers --exports {}".format(mount)
-                )
-            )
-        except subprocess.CalledProcessError:
-            mount_metrics['exports'] = 0
-        else:
-            mount_metrics['exports'] += len(exports.splitlines())
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        exports = b''
+    return len(exports.splitlines()), (time.time() - start) * 1000
 
-        if mount_metrics['exports'] > 0:
-            mount_metrics['online'] = True
+
+def nfs_export_check(timeout=PROBE_TIMEOUT):
+    """Probe the servers of every NFS mount concurrently.
+
+    Each server is probed once however many of its exports are mounted, so
+    a hung server only delays the check by timeout seconds and does not
+    keep the other servers from being reported.
+    """
+    nfs_metrics = dict()
+    servers = nfs_servers()
+    if not servers:
+        return nfs_metrics
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(servers)) as executor:
+        futures = dict((executor.submit(probe, server, timeout), server)
+                       for server in servers)
+        for future in concurrent.futures.as_completed(futures):
+            exports, latency = future.result()
+            nfs_metrics[futures[future]] = {
+                'exports': exports,
+                'online': exports > 0,
+                'latency': latency,
+                'mounts': servers[futures[future]]
+            }
 
     return nfs_metrics
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='NFS exports check')
+    parser.add_argument('--timeout',
+                        type=int,
+                        default=PROBE_TIMEOUT,
+                        help='Seconds each NFS server is given to answer')
     parser.add_argument('--telegraf-output',
                         action='store_true',
                         default=False,
                         help='Set the output format to telegraf')
     args = parser.parse_args()
     with print_output(print_telegraf=args.telegraf_output):
-        nfs_system_check = nfs_export_check()
+        nfs_system_check = nfs_export_check(timeout=args.timeout)
 
         # If there are no returns for the nfs check or the status is ALL
         # online the check is marked as "OK".
@@ -84,3 +129,14 @@ if __name__ == '__main__':
                 metric_bool('nfs_{}_online'.format(sanitized_key),
                             value['online'],
                             m_name='nfs_check')
+
+        # Report how long the online servers took to answer while they fit
+        # within the metrics of the check, the slowest first.
+        online = sorted((i for i in nfs_system_check.items()
+                         if i[1]['online']),
+                        key=lambda i: -i[1]['latency'])
+        remaining = MAX_METRICS - 1 - (len(nfs_system_check) - len(online))
+        for key, value in online[:max(remaining, 0)]:
+            sanitized_key = key.replace('-', '_')
+            metric('nfs_{}_latency'.format(sanitized_key), 'double',
+                   round(value['latency'], 3), 'ms', m_name='nfs_check')
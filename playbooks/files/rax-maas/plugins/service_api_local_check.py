@@ -15,74 +15,190 @@
 # limitations under the License.
 
 import argparse
+import concurrent.futures
 
 import ipaddr
 from maas_common import get_openstack_client
+from maas_common import MAX_METRICS
 from maas_common import metric
 from maas_common import metric_bool
 from maas_common import print_output
+from maas_common import status_err
 from maas_common import status_ok
 import requests
 from requests import exceptions as exc
 
 
-def check(args):
+# Status and response time of every endpoint of a manifest
+ENDPOINT_METRICS = 2
+
+
+def get_auth():
     headers = {'Content-type': 'application/json'}
     path_options = {}
-    if args.auth:
-        keystone = get_openstack_client('identity')
-        auth_token = keystone.get_token()
-        project_id = keystone.get_project_id()
-        headers['auth_token'] = auth_token
-        path_options['project_id'] = project_id
-
-    scheme = args.ssl and 'https' or 'http'
-    endpoint = '{scheme}://{ip}:{port}'.format(ip=args.ip, port=args.port,
-                                               scheme=scheme)
-    if args.version is not None:
-        path_options['version'] = args.version
-    path = args.path.format(path_options)
+    keystone = get_openstack_client('identity')
+    headers['auth_token'] = keystone.get_token()
+    path_options['project_id'] = keystone.get_project_id()
+    return headers, path_options
 
-    s = requests.Session()
-    s.headers.update(headers)
 
-    short_name = args.name.split('_')[0]
+def get_url(endpoint, path_options):
+    scheme = endpoint.get('ssl') and 'https' or 'http'
+    url = '{scheme}://{ip}:{port}'.format(ip=endpoint['ip'],
+                                          port=endpoint['port'],
+                                          scheme=scheme)
+    path_options = dict(path_options)
+    if endpoint.get('version') is not None:
+        path_options['version'] = endpoint['version']
+    path = endpoint.get('path', '').format(path_options)
+
     if path and not path.startswith('/'):
-        url = '/'.join((endpoint, path))
+        return '/'.join((url, path))
     else:
-        url = ''.join((endpoint, path))
+        return ''.join((url, path))
+
+
+def probe(session, url, headers, timeout):
+    """Return whether the endpoint answered and its response time.
+
+    The response time is None when the endpoint did not answer with a
+    successful status code.
+    """
     try:
-        r = s.get(url, verify=False, timeout=180)
+        r = session.get(url, headers=headers, verify=False, timeout=timeout)
     except (exc.ConnectionError, exc.HTTPError, exc.Timeout):
-        is_up = False
-        metric_bool('client_success', False,
-                    m_name='maas_{name}'.format(name=short_name))
-    else:
-        is_up = True
-        metric_bool('client_success', True,
-                    m_name='maas_{name}'.format(name=short_name))
+        return False, None
 
-    status_ok(m_name='maas_{name}'.format(name=short_name))
-    metric_bool('{name}_api_local_status'.format(name=args.name), is_up)
-
-    if is_up and r.ok:
+    milliseconds = None
+    if r.ok:
         milliseconds = r.elapsed.total_seconds() * 1000
-        metric('{name}_api_local_response_time'.format(name=args.name),
+    return True, milliseconds
+
+
+def report(name, is_up, milliseconds):
+    metric_bool('{name}_api_local_status'.format(name=name), is_up)
+    if is_up and milliseconds is not None:
+        metric('{name}_api_local_response_time'.format(name=name),
                'double',
                '%.3f' % milliseconds,
                'ms')
 
 
+def check(args):
+    headers = {'Content-type': 'application/json'}
+    path_options = {}
+    if args.auth:
+        headers, path_options = get_auth()
+
+    endpoint = {'ip': args.ip,
+                'port': args.port,
+                'path': args.path,
+                'ssl': args.ssl,
+                'version': args.version}
+    url = get_url(endpoint, path_options)
+
+    s = requests.Session()
+    s.headers.update(headers)
+
+    short_name = args.name.split('_')[0]
+    is_up, milliseconds = probe(s, url, None, args.timeout)
+    metric_bool('client_success', is_up,
+                m_name='maas_{name}'.format(name=short_name))
+
+    status_ok(m_name='maas_{name}'.format(name=short_name))
+    report(args.name, is_up, milliseconds)
+
+
+def load_manifest(path):
+    """Load the list of endpoints to probe in batch mode.
+
+    The manifest is a YAML (or JSON) list of endpoints, each with the same
+    fields as the command line arguments of a single check::
+
+        - name: swift_proxy_server
+          ip: 172.29.236.100
+          port: 8080
+          path: /healthcheck
+          ssl: false
+          auth: false
+          timeout: 10
+    """
+    import yaml
+
+    with open(path) as f:
+        endpoints = yaml.safe_load(f) or []
+
+    for endpoint in endpoints:
+        for key in ('name', 'ip', 'port'):
+            if key not in endpoint:
+                raise ValueError('Endpoint %s is missing "%s"'
+                                 % (endpoint, key))
+        endpoint['ip'] = ipaddr.IPv4Address(endpoint['ip'])
+        endpoint['port'] = int(endpoint['port'])
+    return endpoints
+
+
+def check_batch(args):
+    """Probe every endpoint in the manifest concurrently.
+
+    All endpoints share one session, and so one keep-alive connection
+    pool, and each request is bounded by the endpoint's own timeout.
+    """
+    try:
+        endpoints = load_manifest(args.manifest)
+    except Exception as e:
+        status_err(str(e), m_name='maas_service_api')
+    if len(endpoints) * ENDPOINT_METRICS > MAX_METRICS:
+        status_err('%d endpoints exceed the %d metrics of a check, split the '
+                   'manifest' % (len(endpoints), MAX_METRICS),
+                   m_name='maas_service_api')
+
+    path_options = {}
+    auth_headers = None
+    if any(e.get('auth') for e in endpoints):
+        auth_headers, path_options = get_auth()
+
+    s = requests.Session()
+    s.headers.update({'Content-type': 'application/json'})
+    pool_size = max(len(endpoints), 1)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+
+    def probe_endpoint(endpoint):
+        # A misconfigured or misbehaving endpoint is reported down without
+        # failing the check of every other endpoint.
+        try:
+            url = get_url(endpoint, path_options)
+            headers = endpoint.get('auth') and auth_headers or None
+            timeout = endpoint.get('timeout', args.timeout)
+            return probe(s, url, headers, timeout)
+        except (exc.RequestException, KeyError, IndexError, ValueError):
+            return False, None
+
+    workers = max(min(len(endpoints), args.workers), 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(probe_endpoint, endpoints))
+
+    status_ok(m_name='maas_service_api')
+    for endpoint, (is_up, milliseconds) in zip(endpoints, results):
+        report(endpoint['name'], is_up, milliseconds)
+
+
 def main(args):
-    check(args)
+    if args.manifest:
+        check_batch(args)
+    else:
+        check(args)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Check service is up.')
-    parser.add_argument('name', help='Service name.')
-    parser.add_argument('ip', type=ipaddr.IPv4Address,
+    parser.add_argument('name', nargs='?', help='Service name.')
+    parser.add_argument('ip', nargs='?', type=ipaddr.IPv4Address,
                         help='Service IP address.')
-    parser.add_argument('port', type=int, help='Service port.')
+    parser.add_argument('port', nargs='?', type=int, help='Service port.')
     parser.add_argument('--path', default='',
                         help='Service API path, this should include '
                              'placeholders for the version "{version}" and'
@@ -92,10 +208,21 @@ if __name__ == "__main__":
     parser.add_argument('--ssl', action='store_true', default=False,
                         help='Should SSL be used.')
     parser.add_argument('--version', help='Service API version.')
+    parser.add_argument('--timeout', type=float, default=180,
+                        help='Request timeout in seconds, the default for '
+                             'endpoints in a manifest without a timeout.')
+    parser.add_argument('--manifest',
+                        help='Probe all endpoints listed in this YAML file '
+                             'concurrently instead of a single service.')
+    parser.add_argument('--workers', type=int, default=16,
+                        help='Maximum number of concurrent requests when '
+                             'using a manifest.')
     parser.add_argument('--telegraf-output',
                         action='store_true',
                         default=False,
                         help='Set the output format to telegraf')
     args = parser.parse_args()
+    if not args.manifest and args.port is None:
+        parser.error('name, ip and port are required without --manifest')
     with print_output(print_telegraf=args.telegraf_output):
         main(args)
@@ -15,11 +15,26 @@
 # limitations under the License.
 
 import argparse
+import configparser
+import errno
+import fcntl
+import os
 import re
 import subprocess
+import sys
+import tempfile
+import time
 
 import maas_common
 
+DISPERSION_CONF = '/etc/swift/dispersion.conf'
+REPORTS = ('object', 'container')
+# Seconds between two dispersion sweeps. A sweep queries every object and
+# container of the dispersion sample, so it is not run every period.
+SWEEP_INTERVAL = 900
+# Concurrent requests of a sweep, swift-dispersion-report defaults to 25.
+SWEEP_CONCURRENCY = 10
+
 # Example output::
 # $ swift-dispersion-report --container-only
 # > Queried 3 containers for dispersion reporting, 0s, 0 retries
@@ -47,20 +62,98 @@ PARSE_RE = re.compile(
 )
 
 
-def generate_report(on):
+def generate_report(on, conf=DISPERSION_CONF, concurrency=None,
+                    timeout=None):
     """Report on either object or container dispersion.
 
     :param str on: Either "object" or "container"
+    :param str conf: The dispersion.conf to use
+    :param int concurrency: Overrides the concurrency of conf when given
     :returns: string of ouptut
     """
-    if on not in {'object', 'container'}:
+    if on not in REPORTS:
         return ''
     call = ['swift-dispersion-report', '--%s-only' % on]
-    return subprocess.check_output(call)
+    if not concurrency:
+        return subprocess.check_output(call + [conf],
+                                       timeout=timeout).decode()
+
+    # The concurrency is only read from the configuration file, run the
+    # report with a private copy of it.
+    config = configparser.ConfigParser(interpolation=None)
+    if not config.read(conf):
+        raise IOError(errno.ENOENT, 'Could not read %s' % conf)
+    config.set('dispersion', 'concurrency', str(concurrency))
+    with tempfile.NamedTemporaryFile('w', suffix='.conf') as f:
+        config.write(f)
+        f.flush()
+        return subprocess.check_output(call + [f.name],
+                                       timeout=timeout).decode()
+
+
+def _cache_name(on):
+    return 'swift_dispersion_%s' % on
+
+
+def sweep(conf=DISPERSION_CONF, concurrency=SWEEP_CONCURRENCY,
+          interval=SWEEP_INTERVAL):
+    """Run the dispersion reports not refreshed for interval seconds and
+    cache their parsed output.
+
+    The reports run one after the other, oldest first, and each is cached
+    as soon as it completes. A report which fails keeps its previous
+    result with the error, and is retried after interval seconds.
+    """
+    lock_path = os.path.join(maas_common.CACHE_DIR, 'swift_dispersion.lock')
+    if not os.path.isdir(maas_common.CACHE_DIR):
+        os.makedirs(maas_common.CACHE_DIR, 0o700)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            # Another sweep is already running
+            return
 
+        results = dict((on, maas_common.read_cache(_cache_name(on)) or {})
+                       for on in REPORTS)
+        for on in sorted(REPORTS,
+                         key=lambda on: results[on].get('collected', 0)):
+            if maas_common.read_cache(_cache_name(on), interval):
+                continue
+            result = results[on]
+            try:
+                output = generate_report(on, conf, concurrency,
+                                         timeout=interval)
+                match = PARSE_RE.search(output)
+                if not match:
+                    raise ValueError('Could not parse %s dispersion report '
+                                     'output' % on)
+            except (IOError, OSError, ValueError, configparser.Error,
+                    subprocess.SubprocessError) as e:
+                result['error'] = str(e)
+            else:
+                result = {'collected': time.time(),
+                          'groups': match.groupdict(),
+                          'error': None}
+            maas_common.write_cache(_cache_name(on), result)
+    finally:
+        os.close(fd)
 
-def print_metrics(report_for, match):
-    group = match.groupdict()
+
+def start_sweep(args):
+    """Start a sweep in the background, detached from the check."""
+    command = [sys.executable, os.path.abspath(__file__), '--sweep',
+               '--conf', args.conf,
+               '--concurrency', str(args.concurrency),
+               '--interval', str(args.interval)]
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(command, stdin=devnull, stdout=devnull,
+                         stderr=devnull, close_fds=True,
+                         start_new_session=True)
+
+
+def print_metrics(report_for, group):
     for (k, v) in group.items():
         if v is None:
             # This happens for container output. The named "num_partitions"
@@ -78,39 +171,56 @@ def print_metrics(report_for, match):
                            unit)
 
 
-def main():
+def main(args):
     # It's easier to parse the output if we make them independent reports
     # If we simply use swift-dispersion-report then we'll have both outputs
     # one after the other and we'll likely have a bad time.
-    try:
-        object_out = generate_report('object')
-        object_match = PARSE_RE.search(object_out)
-    except OSError:
-        # If the subprocess call returns anything other than exit code 0.
-        # we should probably error out too.
-        maas_common.status_err('Could not access object dispersion report',
-                               m_name='maas_swift')
+    results = dict((on, maas_common.read_cache(_cache_name(on)))
+                   for on in REPORTS)
+    if not all(maas_common.read_cache(_cache_name(on), args.interval)
+               for on in REPORTS):
+        try:
+            start_sweep(args)
+        except OSError as e:
+            maas_common.status_err('Could not start dispersion sweep: %s' % e,
+                                   m_name='maas_swift')
 
-    try:
-        container_out = generate_report('container')
-        container_match = PARSE_RE.search(container_out)
-    except OSError:
-        # If the subprocess call returns anything other than exit code 0.
-        # we should probably error out too.
-        maas_common.status_err('Could not access container dispersion report',
-                               m_name='maas_swift')
-
-    if not (object_match and container_match):
-        maas_common.status_err('Could not parse dispersion report output',
-                               m_name='maas_swift')
+    # /run is emptied by every reboot, so the reports are only missing
+    # until the first sweep since the first check completes.
+    now = time.time()
+    first_check = maas_common.read_cache('swift_dispersion_first_check')
+    if first_check is None:
+        first_check = now
+        maas_common.write_cache('swift_dispersion_first_check', first_check)
+
+    for on in REPORTS:
+        result = results[on]
+        if not result or not result.get('groups'):
+            if now - first_check > args.max_age:
+                error = (result or {}).get('error')
+                maas_common.status_err(
+                    error or 'No %s dispersion report collected in %d '
+                    'seconds' % (on, now - first_check), m_name='maas_swift')
+        # Give up on results the sweeps could not refresh for a long time
+        elif now - result['collected'] > args.max_age:
+            maas_common.status_err(
+                'Could not access %s dispersion report: %s'
+                % (on, result.get('error')), m_name='maas_swift')
 
     maas_common.status_ok(m_name='maas_swift')
-    print_metrics('object', object_match)
-    print_metrics('container', container_match)
+    for on in REPORTS:
+        pending = not (results[on] or {}).get('groups')
+        maas_common.metric('%s_sweep_pending' % on, 'uint32', int(pending))
+        if pending:
+            continue
+        print_metrics(on, results[on]['groups'])
+        maas_common.metric('%s_age' % on, 'uint32',
+                           int(now - results[on]['collected']), 's')
 
 # Example output::
 # $ python swift-dispersion.py
 # > status okay
+# > metric object_sweep_pending uint32 0
 # > metric object_retries uint64 0
 # > metric object_seconds uint64 0 s
 # > metric object_num_partitions uint64 2
@@ -120,6 +230,7 @@ def main():
 # > metric object_partition_copies uint64 0
 # > metric object_partition_percent double 0.78
 # > metric object_total_copies uint64 10
+# > metric container_sweep_pending uint32 0
 # > metric container_retries uint64 0
 # > metric container_seconds uint64 0 s
 # > metric container_num_objects uint64 3
@@ -127,6 +238,8 @@ def main():
 # > metric container_copies_found uint64 6
 # > metric container_partition_percent double 1.17
 # > metric container_total_copies uint64 6
+# > metric object_age uint32 312 s
+# > metric container_age uint32 305 s
 
 
 if __name__ == '__main__':
@@ -135,6 +248,31 @@ if __name__ == '__main__':
                         action='store_true',
                         default=False,
                         help='Set the output format to telegraf')
+    parser.add_argument('--conf',
+                        default=DISPERSION_CONF,
+                        help='dispersion.conf used by the sweeps')
+    parser.add_argument('--interval',
+                        type=int,
+                        default=SWEEP_INTERVAL,
+                        help='Seconds between two dispersion sweeps')
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=SWEEP_CONCURRENCY,
+                        help='Concurrent requests of a sweep, 0 to use the '
+                             'concurrency of dispersion.conf')
+    parser.add_argument('--max-age',
+                        type=int,
+                        default=3 * SWEEP_INTERVAL,
+                        help='Seconds after which a report the sweeps could '
+                             'not refresh is reported as an error')
+    parser.add_argument('--sweep',
+                        action='store_true',
+                        default=False,
+                        help='Run the dispersion reports and cache their '
+                             'results instead of reporting the cached ones')
     args = parser.parse_args()
-    with maas_common.print_output(print_telegraf=args.telegraf_output):
-        main()
+    if args.sweep:
+        sweep(args.conf, args.concurrency, args.interval)
+    else:
+        with maas_common.print_output(print_telegraf=args.telegraf_output):
+            main(args)
@@ -21,17 +21,47 @@
 # python swift-recon.py async-pendings
 # python swift-recon.py md5
 # python swift-recon.py quarantine
+# python swift-recon.py time
 
 import argparse
+import concurrent.futures
+import ctypes
+import ctypes.util
+import glob
+import gzip
+import hashlib
+import json
 import os
-import re
-import shlex
-import subprocess
+import struct
+import time
+
+import requests
 
 import maas_common
 from maas_common import status_err
 from maas_common import status_ok
-from maas_common import status_err_no_exit
+
+
+SWIFT_DIR = '/etc/swift'
+# Every check of a period is served by the responses collected by the
+# first one, the checks run every 60 seconds by default.
+RECON_CACHE_TTL = 50
+# swift-recon's own default timeout for a single server
+RECON_REQUEST_TIMEOUT = 5
+RECON_WORKERS = 32
+# Seconds left between the end of the collection and the check timeout to
+# report the responses collected so far before the agent kills the check.
+DEADLINE_MARGIN = 10
+CLONE_NEWNET = 0x40000000
+
+# The recon endpoints queried for each server type, the same ones
+# swift-recon uses for -r, -a, -q, --md5 and --time.
+RECON_ENDPOINTS = {
+    'account': ('replication/account',),
+    'container': ('replication/container',),
+    'object': ('replication/object', 'async', 'quarantined', 'ringmd5',
+               'swiftconfmd5', 'time'),
+}
 
 
 class ParseError(maas_common.MaaSException):
@@ -42,247 +72,265 @@ class CommandNotRecognized(maas_common.MaaSException):
     pass
 
 
-def getcontainer(pattern, containers):
-    c = None
+def find_swift_dir(swift_dir=SWIFT_DIR, deploy_osp=False):
+    """Return the path of swift_dir inside the swift proxy container, and
+    the path of the network namespace of the container.
 
-    for container in containers.split("\n"):
-        if re.search(pattern, container):
-            c = container
-            break
-    return c
-
-
-def get_container_name(deploy_osp, for_ring):
-    container = None
-
-    if not deploy_osp:
-        # identify the container we will use for monitoring
-        get_container = shlex.split(
-            'lxc-ls -1 --running ".*(swift_proxy|swift)"'
-        )
-
-        try:
-            containers_list = subprocess.check_output(get_container)
-            container = containers_list.splitlines()[0]
-        except (IndexError, subprocess.CalledProcessError):
-            return False
-    else:
-        get_containers = ("/usr/local/bin/docker ps -f status=running")
-        containers_list = subprocess.check_output(get_containers.split())
-
-        c = getcontainer('swift_proxy', containers_list)
-        if c:
-            container = c.split()[-1]
-
-    return container
-
-
-def recon_output(for_ring, options=None, swift_recon_path=None,
-                 deploy_osp=False):
-    """Run swift-recon and filter out extraneous printed lines.
-
-    ::
-
-        >>> recon_output('account', '-r')
-        ['[2014-11-21 00:25:16] Checking on replication',
-         '[replication_failure] low: 0, high: 0, avg: 0.0, total: 0, \
-                 Failed: 0.0%, no_result: 0, reported: 2',
-         '[replication_success] low: 2, high: 4, avg: 3.0, total: 6, \
-                 Failed: 0.0%, no_result: 0, reported: 2',
-         '[replication_time] low: 0, high: 0, avg: 0.0, total: 0, \
-                 Failed: 0.0%, no_result: 0, reported: 2',
-         '[replication_attempted] low: 1, high: 2, avg: 1.5, total: 3, \
-                 Failed: 0.0%, no_result: 0, reported: 2',
-         'Oldest completion was 2014-11-21 00:24:51 (25 seconds ago) by \
-                 192.168.31.1:6002.',
-         'Most recent completion was 2014-11-21 00:24:56 (20 seconds ago) by \
-                 192.168.31.2:6002.']
-
-    :param str for_ring: Which ring to run swift-recon on
-    :param list options: Command line options with which to run swift-recon
-    :returns: Strings from output that are most important
-    :rtype: list
+    The rings are read through /proc/<pid>/root of the container, so
+    nothing is run in the container. When there is no swift container,
+    swift_dir and the network namespace of the host are used, the
+    namespace then being None.
     """
+    roles = ('swift_proxy',) if deploy_osp else ('swift_proxy', 'swift')
+    for role in roles:
+        container = maas_common.find_container(role)
+        if container:
+            path = maas_common.container_path(container, swift_dir)
+            if os.path.isdir(path):
+                netns = os.path.join(maas_common.PROC_DIR, str(container.pid),
+                                     'ns', 'net')
+                return path, netns
+    return swift_dir, None
+
+
+def enter_netns(netns):
+    """Move the calling thread into the network namespace at netns.
+
+    The recon requests are sent from the namespace of the proxy container,
+    which reaches the storage network like swift-recon run in it does.
+    setns() only moves the calling thread, so each worker enters it. A
+    worker which cannot stays in the namespace of the host.
+    """
+    if netns is None:
+        return
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    try:
+        fd = os.open(netns, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        libc.setns(fd, CLONE_NEWNET)
+    finally:
+        os.close(fd)
 
-    # identify the container we will use for monitoring
-    container = get_container_name(deploy_osp, for_ring)
-    command = [os.path.join(swift_recon_path or "", 'swift-recon'), for_ring]
-    command.extend(options or [])
-    command_options = ' '.join(command)
-
-    if not container:
-        _full_command = '{command_options}'.format(
-            command_options=command_options
-        )
-    elif deploy_osp:
-        _full_command = '{container_exec_command} {command_options}'.format(
-            container_exec_command='docker exec {}'.format(
-                container
-            ),
-            command_options=command_options
-        )
-    else:
-        _full_command = '{container_exec_command} {command_options}'.format(
-            container_exec_command='lxc-attach -n {} -- bash -c'.format(
-                container
-            ),
-            command_options='"{}"'.format(command_options)
-        )
 
-    full_command = shlex.split(_full_command)
+def ring_devices(path):
+    """Return the devices of a ring file.
 
+    Only rings serialised in the R1NG format of swift are supported, the
+    device list is in the JSON header so the partition tables following
+    it are not read.
+    """
+    with gzip.open(path, 'rb') as f:
+        if f.read(4) != b'R1NG':
+            raise ParseError('{0} is not a R1NG ring file'.format(path))
+        version, = struct.unpack('!H', f.read(2))
+        if version != 1:
+            raise ParseError('Unsupported version {0} of ring file {1}'.format(
+                version, path))
+        json_len, = struct.unpack('!I', f.read(4))
+        ring = json.loads(f.read(json_len).decode('ascii'))
+    return [dev for dev in ring['devs'] if dev]
+
+
+def ring_hosts(swift_dir, server_type):
+    """Return the ip:port of every server in the rings of server_type,
+    the rings of every storage policy for objects."""
+    hosts = set()
+    pattern = os.path.join(swift_dir, '{0}*.ring.gz'.format(server_type))
+    for path in glob.glob(pattern):
+        for dev in ring_devices(path):
+            ip = dev['ip']
+            if ':' in ip:
+                ip = '[{0}]'.format(ip)
+            hosts.add('{0}:{1}'.format(ip, dev['port']))
+    return sorted(hosts)
+
+
+def md5_file(path):
+    # Compared with the md5 sums swift-recon reports, not for security
+    md5 = hashlib.md5()  # nosec
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def recon_get(session, host, endpoint, timeout):
+    """Return the decoded response of a recon endpoint of a server, the time
+    the request started and ended and whether it timed out. The response is
+    None on error."""
+    start = time.time()
+    timed_out = False
+    try:
+        r = session.get('http://{0}/recon/{1}'.format(host, endpoint),
+                        timeout=timeout)
+        r.raise_for_status()
+        response = r.json()
+    except requests.Timeout:
+        response = None
+        timed_out = True
+    except (requests.RequestException, ValueError):
+        response = None
+    return response, start, time.time(), timed_out
+
+
+def collect(swift_dir, deadline, workers=RECON_WORKERS, netns=None):
+    """Query every recon endpoint of every server of the rings.
+
+    All the requests run concurrently over one session so each server is
+    connected to once and its connection reused for all its endpoints.
+    The requests are sent from the network namespace at netns when given.
+    The servers which did not answer within deadline seconds overall, or
+    within the timeout of their own request, are listed as unanswered and
+    have no response, like the servers which answered with an error.
+
+    :returns: The responses, keyed by endpoint and then ip:port, with the
+        md5 sums of the local object rings and swift.conf
+    """
+    hosts = dict((server_type, ring_hosts(swift_dir, server_type))
+                 for server_type in RECON_ENDPOINTS)
+    requested = [(endpoint, host)
+                 for server_type, endpoints in RECON_ENDPOINTS.items()
+                 for endpoint in endpoints
+                 for host in hosts[server_type]]
+    if not requested:
+        raise maas_common.MaaSException(
+            'No swift servers found in the rings of {0}'.format(swift_dir))
+
+    session = requests.Session()
+    pool_size = min(len(requested), workers)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+
+    timeout = min(RECON_REQUEST_TIMEOUT, deadline)
+    responses = dict((endpoint, dict()) for endpoint, _ in requested)
+    unanswered = dict((endpoint, list()) for endpoint, _ in requested)
+    times = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size,
+                                               initializer=enter_netns,
+                                               initargs=(netns,)) as pool:
+        futures = dict(
+            (pool.submit(recon_get, session, host, endpoint, timeout),
+             (endpoint, host))
+            for endpoint, host in requested)
+        # Requests already sent end within their own timeout
+        done, not_done = concurrent.futures.wait(
+            futures, timeout=max(deadline - timeout, 1))
+        for future in not_done:
+            future.cancel()
+        for future, (endpoint, host) in futures.items():
+            if future in done:
+                response, start, end, timed_out = future.result()
+            else:
+                response, start, end, timed_out = None, None, None, True
+            responses[endpoint][host] = response
+            if timed_out:
+                unanswered[endpoint].append(host)
+            if endpoint == 'time':
+                times[host] = (start, end)
+
+    ring_md5 = dict()
+    for path in glob.glob(os.path.join(swift_dir, 'object*.ring.gz')):
+        ring_md5[os.path.basename(path)] = md5_file(path)
     try:
-        out = subprocess.check_output(full_command)
-    except subprocess.CalledProcessError as error:
-        # in case attach command fails we return no metrics rather than
-        # letting it fail to give out red herring alarms
-        status_err_no_exit("Attach container command failed: %s" % str(error),
-                           m_name='maas_swift')
-        return []
-    return filter(lambda s: s and not s.startswith(('==', '-')),
-                  out.split('\n'))
+        swift_conf_md5 = md5_file(os.path.join(swift_dir, 'swift.conf'))
+    except (IOError, OSError):
+        swift_conf_md5 = None
 
+    return {'responses': responses,
+            'unanswered': unanswered,
+            'times': times,
+            'ring_md5': ring_md5,
+            'swift_conf_md5': swift_conf_md5}
 
-def stat_regexp_generator(data):
-    """Generate a regeular expression that will swift-recon stats.
 
-    Lines printed by swift-recon look like::
+def gen_stats(values):
+    """Compute the statistics swift-recon prints for a set of values.
 
-        [data] low: 0, high: 0, avg: 0.0, total: 0, Failed: 0.0%, \
-                no_result: 0, reported: 0
+    ::
 
-    Where data above is the value of the ``data`` parameter passed to the
-    function.
-    """
-    expression = r"""\s+low:\s+(?P<low>\d+),     # parse out the low result
-                    \s+high:\s+(?P<high>\d+),   # parse out the high result
-                    \s+avg:\s+(?P<avg>\d+.\d+), # you get the idea now
-                    \s+total:\s+(?P<total>\d+),
-                    \s+Failed:\s+(?P<failed>\d+.\d+%),
-                    \s+no_result:\s+(?P<no_result>\d+),
-                    \s+reported:\s+(?P<reported>\d+)"""
-    return re.compile(r'\[' + data + r'\]' + expression, re.VERBOSE)
-
-
-def _parse_into_dict(line, parsed_by):
-    match = parsed_by.match(line)
-    if match:
-        return match.groupdict()
-    else:
-        raise ParseError("Cannot parse '{0}' for statistics.".format(line))
-
-
-def recon_stats_dicts(for_ring, options, starting_with, parsed_by,
-                      swift_recon_path=None, deploy_osp=False):
-    """Return a list of dictionaries of parsed statistics.
-
-    Swift-recon has a standard format for it's statistics:
-
-    [name] low: 0, high: 0, avg: 0.0, total: 0, Failed: 0.0%, no_result: 0, \
-            reported: 0
-
-    Using the regular expression passed by the user in ``parsed_by``, we parse
-    this out and return dictionaries of lines that start with
-    ``starting_with``. This is after we get the recon output for the ring and
-    options.
-
-    :param str for_ring: Which ring to run swift-recon on
-    :param list options: Command line options with which to run swift-recon
-    :param str starting_with: String with which to filter lines
-    :param parsed_by: Compiled regular expression to match and parse with
-    :type parsed_by: _sre.SRE_Pattern (the result of calling re.compile)
-    :returns: list of dictionaries of parse data
+        >>> gen_stats({'10.0.0.1:6002': 2, '10.0.0.2:6002': 4,
+        ...            '10.0.0.3:6002': None})
+        {'avg': 3.0,
+         'failed': 33.3,
+         'high': 4,
+         'high_host': '10.0.0.2:6002',
+         'low': 2,
+         'no_result': 1,
+         'reported': 2,
+         'total': 6}
+
+    :param dict values: Value returned by each server, None when the server
+        did not return one
+    :returns: The statistics, or None when no server returned a value
     """
-    return map(lambda l: _parse_into_dict(l, parsed_by),
-               filter(lambda s: s.startswith(starting_with),
-                      recon_output(for_ring, options,
-                                   swift_recon_path=swift_recon_path,
-                                   deploy_osp=deploy_osp)))
-
-
-def swift_replication(for_ring, swift_recon_path=None, deploy_osp=False):
-    """Parse swift-recon's replication statistics and return them.
+    reported = dict((host, value) for host, value in values.items()
+                    if value is not None)
+    if not reported:
+        return None
+    total = sum(reported.values())
+    no_result = len(values) - len(reported)
+    return {'low': int(min(reported.values())),
+            'high': int(max(reported.values())),
+            'high_host': max(sorted(reported), key=reported.get),
+            'avg': round(float(total) / len(reported), 1),
+            'total': int(total),
+            'failed': round(no_result * 100.0 / len(values), 1),
+            'no_result': no_result,
+            'reported': len(reported)}
+
+
+def answered(recon, endpoint):
+    return dict((host, response)
+                for host, response in recon['responses'][endpoint].items()
+                if response is not None)
+
+
+def swift_replication(recon, for_ring):
+    """Return the replication statistics of a ring.
 
     ::
 
-        >>> swift_replication('account')
-        {'attempted': {'avg': '1.5',
-                       'failed': '0.0%',
-                       'high': '2',
-                       'low': '1',
-                       'no_result': '0',
-                       'reported": '5',
-                       'total': '3'},
-         'failure': {'avg': '0.0',
-                     'failed': '0.0%',
-                     'high': '0',
-                     'low': '0',
-                     'no_result': '0',
-                     'reported": '5',
-                     'total': '0'},
-         'success': {'avg': '3.0',
-                     'failed': '0.0%',
-                     'high': '4',
-                     'low': '2',
-                     'no_result': '0',
-                     'reported": '5',
-                     'total': '6'},
-         'time': {'avg': '0.0',
-                  'failed': '0.0%',
-                  'high': '0',
-                  'low': '0',
-                  'no_result': '0',
-                  'reported": '5',
-                  'total': '0'}}
-
-    :param str for_ring: Which ring to run swift-recon on
-    :returns: Dictionary of attempted, failed, success, and time statistics
+        >>> swift_replication(recon, 'account')
+        {'attempted': {'avg': 1.5, 'failed': 0.0, 'high': 2, 'low': 1,
+                       'no_result': 0, 'reported': 2, 'total': 3, ...},
+         'failure': {...},
+         'success': {...},
+         'time': {...}}
+
+    :param str for_ring: Which ring to compute the statistics for
+    :returns: Dictionary of attempted, failure, success, and time statistics
     :rtype: dict
     """
-    regexp = stat_regexp_generator(r'replication_(?P<replication_type>\w+)')
-    replication_dicts = recon_stats_dicts(for_ring, ['-r'], '[replication_',
-                                          regexp,
-                                          swift_recon_path=swift_recon_path,
-                                          deploy_osp=deploy_osp)
-
-    # reduce could work here but would require an enclosed function which is
-    # less readable than this loop
-    replication_statistics = {}
-    for rep_dict in replication_dicts:
-        replication_statistics[rep_dict.pop('replication_type')] = rep_dict
+    values = {'attempted': {}, 'failure': {}, 'success': {}, 'time': {}}
+    responses = answered(recon, 'replication/{0}'.format(for_ring))
+    for host, response in responses.items():
+        values['time'][host] = response.get(
+            'replication_time', response.get('object_replication_time', 0))
+        replication_stats = response.get('replication_stats')
+        if replication_stats:
+            for name in ('attempted', 'failure', 'success'):
+                values[name][host] = replication_stats.get(name)
 
+    replication_statistics = {}
+    for name, host_values in values.items():
+        stats = gen_stats(host_values)
+        if stats:
+            replication_statistics[name] = stats
     return replication_statistics
 
 
-def swift_async(swift_recon_path=None, deploy_osp=False):
-    """Parse swift-recon's async pendings statistics and return them.
+def swift_async(recon):
+    """Return the async pendings statistics of the object servers.
 
-    ::
-
-        >>> swift_async()
-        {'avg': '0.0',
-         'failed': '0.0%',
-         'high': '0',
-         'low': '0',
-         'no_result': '0',
-         'reported': '2',
-         'total': '0'}
-
-    :returns: Dictionary of average, failed, high, low, no_result, reported,
-        and total statistics.
+    :returns: Dictionary of the async statistics
     """
-    regexp = stat_regexp_generator('async_pending')
-    async_dicts = recon_stats_dicts('object', ['-a'], '[async_pending]',
-                                    regexp, swift_recon_path=swift_recon_path,
-                                    deploy_osp=deploy_osp)
-    stats = {}
-    for async_dict in async_dicts:
-        if async_dict:
-            stats = async_dict
-            # Break will skip the for-loop's else block
-            break
-    else:
-        # If we didn't find a non-empty dict, error out
+    stats = gen_stats(dict(
+        (host, response.get('async_pending'))
+        for host, response in answered(recon, 'async').items()))
+    if not stats:
         status_err(
             'No data could be collected about pending async operations',
             m_name='maas_swift'
@@ -290,137 +338,118 @@ def swift_async(swift_recon_path=None, deploy_osp=False):
     return {'async': stats}
 
 
-def swift_quarantine(swift_recon_path=None, deploy_osp=False):
-    """Parse swift-recon's quarantined objects and return them.
+def swift_quarantine(recon):
+    """Return the quarantined objects, accounts and containers statistics.
 
-    ::
-
-        >>> swift_quarantine()
-        {'accounts': {'avg': '0.0',
-                      'failed': '0.0%',
-                      'high': '0',
-                      'low': '0',
-                      'no_result': '0',
-                      'reported': '2',
-                      'total': '0'},
-         'containers': {'avg': '0.0',
-                        'failed': '0.0%',
-                        'high': '0',
-                        'low': '0',
-                        'no_result': '0',
-                        'reported': '2',
-                        'total': '0'},
-         'objects': {'avg': '0.0',
-                     'failed': '0.0%',
-                     'high': '0',
-                     'low': '0',
-                     'no_result': '0',
-                     'reported': '2',
-                     'total': '0'}}
-
-    :returns: Dictionary of objects, accounts, and containers.
+    :returns: Dictionary of objects, accounts, and containers statistics
     """
-    regexp = stat_regexp_generator(r'quarantined_(?P<ring>\w+)')
-    quarantined_dicts = recon_stats_dicts('-q', [], '[quarantined_',
-                                          regexp,
-                                          swift_recon_path=swift_recon_path,
-                                          deploy_osp=deploy_osp)
-
+    responses = answered(recon, 'quarantined')
     quarantined_statistics = {}
-    for quar_dict in quarantined_dicts:
-        quarantined_statistics[quar_dict.pop('ring')] = quar_dict
-
+    for name in ('objects', 'accounts', 'containers'):
+        stats = gen_stats(dict((host, response.get(name))
+                               for host, response in responses.items()))
+        if stats:
+            quarantined_statistics[name] = stats
     return quarantined_statistics
 
 
-def swift_md5(swift_recon_path=None, deploy_osp=False):
-    """Parse swift-recon's md5 check output and return it.
+def _host_address(host):
+    return host.rsplit(':', 1)[0].strip('[]')
+
+
+def swift_md5(recon):
+    """Compare the md5 sums of the rings and swift.conf of the object
+    servers with the local ones.
 
     ::
 
-        >>> swift_md5()
-        {'ring': {'errors': '0', 'success': '2', 'total': '2'},
-         'swiftconf': {'errors': '0', 'success': '2', 'total': '2'}}
+        >>> swift_md5(recon)
+        {'ring': {'errors': 1, 'no_result': 1, 'success': 2, 'total': 3},
+         'swift_conf': {'errors': 1, 'no_result': 1, 'success': 2,
+                        'total': 3}}
+
+    errors counts every server without a valid answer, no_result the ones
+    among them which did not answer before the deadline.
 
-    :returns: Dictioanry
+    :returns: Dictionary
     """
-    check_re = re.compile(r'Checking\s+(?P<check>[^\s]+)\s+md5sums?')
-    error_re = re.compile(r'https?://(?P<address>[^:]+):\d+')
-    result_re = re.compile(
-        r'(?P<success>\d+)/(?P<total>\d+)[^\d]+(?P<errors>\d+).*'
-    )
-    # We need to pass --md5 as a string here
-    output = recon_output('--md5', swift_recon_path=swift_recon_path,
-                          deploy_osp=deploy_osp)
     md5_statistics = {}
-    checking_dict = {}
-    for line in output:
-        check_match = check_re.search(line)
-        if check_match and not checking_dict:
-            checking_dict = check_match.groupdict()
-            # First line of a grouping we care about, might as well skip all
-            # other checks in the loop
-            continue
-        # If there was an error checking the md5sum, error out immediately
-        if line.startswith('!!'):
-            error_dict = error_re.search(line).groupdict()
-            status_err(
-                'md5 mismatch for {0} on host {1}'.format(
-                    checking_dict.get('check'),
-                    error_dict['address']
-                ),
-                m_name='maas_swift'
-            )
-        results_match = result_re.match(line)
-        if results_match:
-            check_name = checking_dict['check'].replace('.', '_')
-            md5_statistics[check_name] = results_match.groupdict()
-            checking_dict = {}
-
+    for check, endpoint in (('ring', 'ringmd5'),
+                            ('swift.conf', 'swiftconfmd5')):
+        responses = recon['responses'][endpoint]
+        matches = errors = 0
+        for host, response in sorted(responses.items()):
+            if response is None:
+                errors += 1
+                continue
+            if check == 'ring':
+                mismatch = []
+                for path, md5 in response.items():
+                    name = os.path.basename(path)
+                    if not name.startswith('object'):
+                        continue
+                    if recon['ring_md5'].get(name) != md5:
+                        mismatch.append(path)
+            else:
+                mismatch = [path for path, md5 in response.items()
+                            if md5 != recon['swift_conf_md5']]
+            # A mismatch is an error straight away, as with swift-recon
+            if mismatch:
+                status_err(
+                    'md5 mismatch for {0} on host {1}'.format(
+                        check, _host_address(host)),
+                    m_name='maas_swift'
+                )
+            matches += 1
+        md5_statistics[check.replace('.', '_')] = {
+            'success': matches, 'total': len(responses), 'errors': errors,
+            'no_result': len(recon['unanswered'][endpoint])}
     return md5_statistics
 
 
-def swift_time(swift_recon_path=None, deploy_osp=False):
-    """Parse swift-recon's time sync check output and return it.
+def swift_time(recon):
+    """Compare the time of the object servers with the local time.
 
     ::
 
-        >>> swift_time()
-        {'time_sync': {'total': '3', 'errors': '0', 'success': '1',
-         'time_differ': 1735200}}
+        >>> swift_time(recon)
+        {'time_sync': {'total': 3, 'errors': 0, 'no_result': 0,
+         'success': 2, 'time_differ': 1735200,
+         'time_differ_host': '10.0.0.3:6000'}}
+
+    The clock offset of a server is its time minus the middle of the
+    request, when the server most likely read its clock. The skew is the
+    part of the offset which half the round trip time does not account
+    for, so slow responses are not mistaken for clock skew. A server
+    matches when it has no skew, as swift-recon checks.
 
     :returns: Dictionary
     """
-    check_re = re.compile(r'Checking\s+(?P<check>[^\s]+)?')
-    time_re = re.compile(r'by\s(?P<time_differ>[^\s]+)\ssec')
-    result_re = re.compile(
-        r'(?P<success>\d+)/(?P<total>\d+)[^\d]+(?P<errors>\d+).*'
-    )
-    # We need to pass --time as a string here
-    output = recon_output('--time', swift_recon_path=swift_recon_path,
-                          deploy_osp=deploy_osp)
-    time_statistics = {}
-    checking_dict = {}
-    times = [0]
-    for line in output:
-        check_match = check_re.search(line)
-        if check_match and not checking_dict:
-            checking_dict = check_match.groupdict()
-            # First line of a grouping we care about, might as well skip all
-            # other checks in the loop
+    responses = recon['responses']['time']
+    matches = errors = 0
+    skews = {}
+    for host, remote_time in responses.items():
+        if remote_time is None:
+            errors += 1
             continue
-        if line.startswith('!!'):
-            time_dict = time_re.search(line).groupdict()
-            time_output = int(float(time_dict['time_differ']))
-            times.append(time_output)
-        results_match = result_re.match(line)
-        if results_match:
-            check_name = checking_dict['check'].replace('-', '_')
-            time_statistics[check_name] = results_match.groupdict()
-            checking_dict = {}
-
-    time_statistics[check_name]['time_differ'] = max(times)
-    return time_statistics
+        start, end = recon['times'][host]
+        offset = remote_time - (start + end) / 2.0
+        skew = max(abs(offset) - (end - start) / 2.0, 0.0)
+        if skew:
+            skews[host] = skew
+        else:
+            matches += 1
+
+    time_statistics = {'success': matches,
+                       'total': len(responses),
+                       'errors': errors,
+                       'no_result': len(recon['unanswered']['time']),
+                       'time_differ': 0}
+    if skews:
+        worst = max(sorted(skews), key=skews.get)
+        time_statistics['time_differ'] = int(skews[worst])
+        time_statistics['time_differ_host'] = worst
+    return {'time_sync': time_statistics}
 
 
 def print_nested_stats(statistics):
@@ -433,19 +462,22 @@ def print_nested_stats(statistics):
 
     ::
 
-        >>> a = {'accounts': {'avg': '0.0',
-                              'failed': '0.0%',
-                              'high': '0',
-                              'low': '0',
-                              'no_result': '0',
-                              'reported': '2',
-                              'total': '0'}}
+        >>> a = {'accounts': {'avg': 0.0,
+                              'failed': 0.0,
+                              'high': 0,
+                              'high_host': '10.0.0.1:6002',
+                              'low': 0,
+                              'no_result': 0,
+                              'reported': 2,
+                              'total': 0}}
         >>> print_nested_stats(a)
         metric accounts_avg double 0.0
         metric accounts_failed double 0.0
         metric accounts_high uint64 0
+        metric accounts_high_host string 10.0.0.1:6002
         metric accounts_low uint64 0
         metric accounts_no_result uint64 0
+        metric accounts_reported uint64 2
         metric accounts_total uint64 0
 
     """
@@ -455,7 +487,10 @@ def print_nested_stats(statistics):
 
 metrics_per_stat = {
     'avg': lambda name, val: maas_common.metric(name, 'double', val),
-    'failed': lambda name, val: maas_common.metric(name, 'double', val[:-1])
+    'failed': lambda name, val: maas_common.metric(name, 'double', val),
+    'high_host': lambda name, val: maas_common.metric(name, 'string', val),
+    'time_differ_host': lambda name, val: maas_common.metric(name, 'string',
+                                                             val)
 }
 
 
@@ -489,10 +524,27 @@ def make_parser():
                         help='Set the output format to telegraf')
     parser.add_argument('--swift-recon-path',
                         default='/usr/local/bin',
-                        help='The path for the swift-recon directory.')
+                        help='Unused, the recon endpoints are queried '
+                             'directly. Kept for existing checks.')
+    parser.add_argument('--swift-dir',
+                        default=SWIFT_DIR,
+                        help='Directory of the rings and swift.conf, in the '
+                             'swift proxy container when there is one.')
     parser.add_argument('-t',
-                        default='30',
-                        help='Set a timeout value in seconds for swift-recon.')
+                        type=int,
+                        default=30,
+                        help='Timeout of the check in seconds, the recon '
+                             'responses are collected until %d seconds '
+                             'before it.' % DEADLINE_MARGIN)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=RECON_WORKERS,
+                        help='Maximum number of concurrent recon requests')
+    parser.add_argument('--cache-ttl',
+                        type=int,
+                        default=RECON_CACHE_TTL,
+                        help='Seconds the recon responses are reused by the '
+                             'other swift-recon checks, 0 to disable.')
     # add deploy_osp arg
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
@@ -503,31 +555,39 @@ def make_parser():
     return parser
 
 
+def get_recon(args):
+    """Return the recon responses of every server, shared by all the
+    swift-recon checks through the maas_common cache."""
+    swift_dir, netns = find_swift_dir(args.swift_dir, args.deploy_osp)
+    deadline = max(args.t - DEADLINE_MARGIN, 1)
+    return maas_common.get_cached('swift_recon', args.cache_ttl, collect,
+                                  swift_dir, deadline, workers=args.workers,
+                                  netns=netns)
+
+
 def get_stats_from(args):
     stats = {}
-    deploy_osp = args.deploy_osp
 
+    if args.recon not in ('async-pendings', 'md5', 'quarantine',
+                          'replication', 'time'):
+        raise CommandNotRecognized('unrecognized command "{0}"'.format(
+            args.recon))
+    if args.recon == 'replication' and args.ring not in {"account",
+                                                         "container",
+                                                         "object"}:
+        status_err('no ring provided to check', m_name='maas_swift')
+
+    recon = get_recon(args)
     if args.recon == 'async-pendings':
-        stats = swift_async(swift_recon_path=args.swift_recon_path,
-                            deploy_osp=deploy_osp)
+        stats = swift_async(recon)
     elif args.recon == 'md5':
-        stats = swift_md5(swift_recon_path=args.swift_recon_path,
-                          deploy_osp=deploy_osp)
+        stats = swift_md5(recon)
     elif args.recon == 'quarantine':
-        stats = swift_quarantine(swift_recon_path=args.swift_recon_path,
-                                 deploy_osp=deploy_osp)
+        stats = swift_quarantine(recon)
     elif args.recon == 'replication':
-        if args.ring not in {"account", "container", "object"}:
-            status_err('no ring provided to check', m_name='maas_swift')
-        stats = swift_replication(args.ring,
-                                  swift_recon_path=args.swift_recon_path,
-                                  deploy_osp=deploy_osp)
+        stats = swift_replication(recon, args.ring)
     elif args.recon == 'time':
-        stats = swift_time(swift_recon_path=args.swift_recon_path,
-                           deploy_osp=deploy_osp)
-    else:
-        raise CommandNotRecognized('unrecognized command "{0}"'.format(
-            args.recon))
+        stats = swift_time(recon)
     return stats
 
 
@@ -536,7 +596,7 @@ def main():
 
     try:
         stats = get_stats_from(args)
-    except (ParseError, CommandNotRecognized) as e:
+    except (IOError, OSError, maas_common.MaaSException) as e:
         status_err(str(e), m_name='maas_swift')
 
     if stats:
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# Copyright 2026, Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare loading and streaming a RabbitMQ /api/queues listing.
+
+Record a payload on a rabbit node with::
+
+    curl -u maas_user:secret \
+        'http://localhost:15672/api/queues?columns=name,messages,consumers' \
+        > queues.json
+
+and run::
+
+    rabbitmq-json-benchmark.py --fixture queues.json
+
+Without a fixture a synthetic listing of --queues queues is generated, its
+entries only carry the three requested columns so it does not stand for
+the payload of a real node. Each
+parser runs in its own interpreter so the peak RSS of one does not hide the
+other.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+DEFAULT_PLUGIN_DIR = '/usr/lib/rackspace-monitoring-agent/plugins'
+CHUNK_SIZE = 64 * 1024
+
+
+def aggregate(queues):
+    totals = {'messages': 0, 'consumers': 0, 'queues': 0}
+    for queue in queues:
+        totals['messages'] += queue.get('messages') or 0
+        totals['consumers'] += queue.get('consumers') or 0
+        totals['queues'] += 1
+    return totals
+
+
+def read_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def parse_load(path):
+    """The previous behaviour, response.json() on the whole body."""
+    content = b''.join(read_chunks(path))
+    return aggregate(json.loads(content.decode('utf-8')))
+
+
+def parse_stream(path):
+    from maas_common import iter_json_array
+
+    return aggregate(iter_json_array(read_chunks(path)))
+
+
+def run_parser(args):
+    sys.path.insert(0, args.plugin_dir)
+    # Import before measuring so only the parsing is accounted for
+    import maas_common  # noqa
+
+    parser = {'load': parse_load, 'stream': parse_stream}[args.parser]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.monotonic()
+    totals = parser(args.fixture)
+    elapsed = time.monotonic() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'parser': args.parser,
+                      'seconds': elapsed,
+                      'peak_rss_kb': peak - baseline,
+                      'totals': totals}))
+
+
+def write_fixture(queues):
+    fd, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        f.write('[')
+        for i in range(queues):
+            if i:
+                f.write(',')
+            json.dump({'name': 'queue-%d' % i,
+                       'messages': i % 100,
+                       'consumers': i % 3}, f)
+        f.write(']')
+    return path
+
+
+def main(args):
+    fixture = args.fixture or write_fixture(args.queues)
+    try:
+        results = []
+        for parser in ('load', 'stream'):
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 '--plugin-dir', args.plugin_dir,
+                 '--fixture', fixture,
+                 '--run-parser', parser])
+            results.append(json.loads(output.decode()))
+    finally:
+        if not args.fixture:
+            os.unlink(fixture)
+
+    if results[0]['totals'] != results[1]['totals']:
+        sys.exit('Parsers disagree: %s' % results)
+
+    print('%-8s %12s %16s' % ('parser', 'seconds', 'peak RSS (KiB)'))
+    for result in results:
+        print('%-8s %12.3f %16d' % (result['parser'], result['seconds'],
+                                    result['peak_rss_kb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark streaming of RabbitMQ API listings')
+    parser.add_argument('--plugin-dir',
+                        default=DEFAULT_PLUGIN_DIR,
+                        help='Directory containing maas_common.py')
+    parser.add_argument('--fixture',
+                        help='Recorded /api/queues response body')
+    parser.add_argument('--queues',
+                        type=int,
+                        default=50000,
+                        help='Number of queues in the synthetic listing')
+    parser.add_argument('--run-parser',
+                        dest='parser',
+                        choices=['load', 'stream'],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.parser:
+        run_parser(args)
+    else:
+        main(args)
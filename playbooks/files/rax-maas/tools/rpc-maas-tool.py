@@ -19,6 +19,7 @@ from __future__ import print_function
 import argparse
 import configparser
 import datetime
+import json
 import logging
 import os
 from queue import Queue
@@ -36,12 +37,41 @@ from rackspace_monitoring.types import Provider
 import alarmparser
 
 DEFAULT_CONFIG_FILE = '/root/.raxrc'
+DEFAULT_PLUGIN_DIR = '/usr/lib/rackspace-monitoring-agent/plugins'
 logging.basicConfig(level=logging.DEBUG,
                     datefmt="",
                     format="%(message)s",
                     stream=sys.stdout)
 LOGGER = logging.getLogger(__name__)
 
+# Plugins which only look at the local host and must not import the
+# OpenStack client libraries when they start.
+HOST_ONLY_PLUGINS = [
+    'bonding_iface_check',
+    'conntrack_count',
+    'maas_poller_fd_count',
+    'network_stats_check'
+]
+
+# Modules which are only needed by plugins talking to OpenStack APIs.
+HEAVY_MODULES = [
+    'distro',
+    'keystoneauth1',
+    'monitorstack',
+    'openstack',
+    'requests'
+]
+
+IMPORT_TIME_SCRIPT = '''
+import importlib, json, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.monotonic()
+importlib.import_module(sys.argv[2])
+elapsed = time.monotonic() - start
+print(json.dumps({'elapsed': elapsed,
+                  'modules': [m for m in sys.argv[3:] if m in sys.modules]}))
+'''
+
 # Exclude checks that RAX MaaS includes by default
 EXCLUDEDCHECK_BASE = [
     'filesystem',
@@ -245,7 +275,8 @@ class RpcMassCli(object):
         self.parse_args()
         LOGGER.addHandler(logging.FileHandler(self.args.logfile))
         use_api = True
-        if self.args.command in ['verify-alarm-syntax', 'verify-local']:
+        if self.args.command in ['verify-alarm-syntax', 'verify-local',
+                                 'verify-import-time']:
             use_api = False
         self.rpcm = RpcMaas(self.args.entitymatch,
                             self.args.entity,
@@ -266,6 +297,7 @@ class RpcMassCli(object):
                                      'verify-created',
                                      'verify-status',
                                      'verify-local',
+                                     'verify-import-time',
                                      'remove-defunct-checks',
                                      'remove-defunct-alarms'],
                             help='Command to execute')
@@ -309,6 +341,16 @@ class RpcMassCli(object):
                             action="store_true",
                             help='Show items without failures when listing'
                                  'alarms or running checks')
+        parser.add_argument('--plugindir',
+                            type=str,
+                            help='path to the MaaS plugins',
+                            default=DEFAULT_PLUGIN_DIR)
+        parser.add_argument('--import-budget',
+                            type=float,
+                            help='Maximum time in seconds a host only plugin'
+                                 ' may take to import, used by'
+                                 ' verify-import-time',
+                            default=0.5)
         parser.add_argument('--excludedcheck',
                             action="append",
                             help='A check that should not be present'
@@ -334,7 +376,8 @@ class RpcMassCli(object):
               'remove-defunct-checks': self.remove_defunct_checks,
               'remove-defunct-alarms': self.remove_defunct_alarms,
               'verify-alarm-syntax': self.verify_alarm_syntax,
-              'verify-local': self.verify_local
+              'verify-local': self.verify_local,
+              'verify-import-time': self.verify_import_time
               }
         result = dd[self.args.command]()
         if result is None:
@@ -531,6 +574,38 @@ class RpcMassCli(object):
 
         return 1
 
+    def verify_import_time(self):
+        """Check the cold start cost of the host only plugins
+
+        Each plugin is imported in a new interpreter, the same way the
+        agent starts it. A plugin fails when importing it takes longer
+        than the import budget or when it pulls in any of the modules
+        only needed to talk to OpenStack.
+        """
+
+        failed_plugins = []
+        for plugin in HOST_ONLY_PLUGINS:
+            output = subprocess.check_output(
+                [sys.executable, '-c', IMPORT_TIME_SCRIPT,
+                 self.args.plugindir, plugin] + HEAVY_MODULES)
+            result = json.loads(output.decode().splitlines()[-1])
+            LOGGER.info("{plugin}: imported in {elapsed:.3f}s".format(
+                plugin=plugin, elapsed=result['elapsed']))
+            too_slow = result['elapsed'] > self.args.import_budget
+            if too_slow or result['modules']:
+                failed_plugins.append((plugin, result))
+
+        if failed_plugins:
+            LOGGER.info(
+                "The following plugins exceeded the import budget of "
+                "{budget}s or imported OpenStack client modules: "
+                "{plugins}".format(budget=self.args.import_budget,
+                                   plugins=failed_plugins))
+            return 1
+
+        LOGGER.info("All host only plugins are within the import budget")
+        return 0
+
     def checks_without_alarms(self):
         """list checks with no alarms"""
         no_alarms = list()
@@ -15,9 +15,11 @@
 # limitations under the License.
 
 import argparse
+import concurrent.futures
 import subprocess
 
 from itertools import chain
+from maas_common import iter_json_array
 from maas_common import metric
 from maas_common import metric_bool
 from maas_common import print_output
@@ -26,12 +28,12 @@ from maas_common import status_ok
 import re
 import requests
 
+# NOTE: The columns filter makes the management API return only the fields
+#       read by this plugin, which matters on clusters with many queues.
 OVERVIEW_URL = "%s://%s:%s/api/overview"
-NODES_URL = "%s://%s:%s/api/nodes"
+NODES_URL = "%s://%s:%s/api/nodes?columns=%s"
 CONNECTIONS_URL = "%s://%s:%s/api/connections?columns=channels"
-QUEUES_URL = "%s://%s:%s/api/queues"
-CONSUMERS_QUEUES_URL = "%s://%s:%s/api/queues/%s"
-VHOSTS_URL = "%s://%s:%s/api/vhosts"
+QUEUES_URL = "%s://%s:%s/api/queues?columns=name,messages,consumers"
 
 CLUSTERED = True
 # NOTE(cloudnull): The cluster size is set using a Jinja2 variable
@@ -64,6 +66,12 @@ NODES_METRICS = {"proc_used": "processes",
 
 CONNECTIONS_METRICS = {"max_channels_per_conn": "channels"}
 
+# Bytes read at a time when streaming the queues and connections listings
+STREAM_CHUNK_SIZE = 64 * 1024
+
+NODES_COLUMNS = ','.join(['name', 'partitions', 'cluster_links',
+                          *sorted(NODES_METRICS)])
+
 
 def hostname():
     """Return the name of the current host/node."""
@@ -126,10 +134,31 @@ def _get_rabbit_json(session, url):
             response.status_code), m_name='maas_rabbitmq')
 
 
-def _get_connection_metrics(session, metrics, protocol, host, port):
+def _iter_rabbit_json(session, url):
+    """Yield the elements of a JSON array returned by the RabbitMQ API.
+
+    The response is decoded while it is read instead of loading the whole
+    listing, which can be hundreds of MB on clusters with many queues.
+    """
+    try:
+        response = session.get(url, verify=False, stream=True)
+    except requests.exceptions.ConnectionError as e:
+        metric_bool('client_success', False, m_name='maas_rabbitmq')
+        status_err(str(e), m_name='maas_rabbitmq')
+
+    with response:
+        if not response.ok:
+            metric_bool('client_success', False, m_name='maas_rabbitmq')
+            status_err('Received status {0} from RabbitMQ API'.format(
+                response.status_code), m_name='maas_rabbitmq')
+        for item in iter_json_array(
+                response.iter_content(chunk_size=STREAM_CHUNK_SIZE)):
+            yield item
 
-    response = _get_rabbit_json(session, CONNECTIONS_URL % (protocol,
-                                                            host, port))
+
+def _get_connection_metrics(session, metrics, protocol, host, port):
+    response = _iter_rabbit_json(session, CONNECTIONS_URL % (protocol,
+                                                             host, port))
 
     max_chans = max(chain(connection['channels'] for connection in response
                     if 'channels' in connection))
@@ -148,7 +177,8 @@ def _get_overview_metrics(session, metrics, protocol, host, port):
 
 
 def _get_node_metrics(session, metrics, protocol, host, port, name):
-    response = _get_rabbit_json(session, NODES_URL % (protocol, host, port))
+    response = _get_rabbit_json(session, NODES_URL % (protocol, host, port,
+                                                      NODES_COLUMNS))
 
     # Either use the option provided by the commandline flag or the current
     # hostname
@@ -179,14 +209,23 @@ def _get_node_metrics(session, metrics, protocol, host, port, name):
 
 
 def _get_queue_metrics(session, metrics, protocol, host, port):
-    response = _get_rabbit_json(session, QUEUES_URL % (protocol, host, port))
+    """Aggregate the queue metrics from a single /api/queues response.
+
+    /api/queues covers every vhost, so the queues without consumers are
+    counted here as well instead of listing the queues of each vhost again.
+    The queues are aggregated as the response is streamed.
+    """
+    response = _iter_rabbit_json(session, QUEUES_URL % (protocol, host, port))
     msgs_excl_notifications = 0
     notification_messages = 0
     msgs_without_consumers = 0
+    queues_without_consumers = 0
     for queue in response:
         messages = queue.get('messages')
         consumers = queue.get('consumers')
         name = queue.get('name')
+        if not consumers and messages:
+            queues_without_consumers += 1
         # RabbitMQ sometimes responds w/o messages or consumers (TURTLES-715)
         if messages is None or consumers is None or name is None:
             continue
@@ -210,26 +249,6 @@ def _get_queue_metrics(session, metrics, protocol, host, port):
         'value': msgs_without_consumers,
         'unit': 'messages'
     }
-
-
-def _get_consumer_metrics(session, metrics, protocol, host, port):
-    VHOSTS = []
-    vhosts_response = _get_rabbit_json(session, VHOSTS_URL % (protocol,
-                                                              host, port))
-    # get the vhosts
-    for vhost in vhosts_response:
-        VHOSTS.append(vhost['name'])
-
-    queues_without_consumers = 0
-    for vhost in VHOSTS:
-        # uri encode /
-        URI_ENCODED = vhost.replace('/', '%2F')
-        queue_response = _get_rabbit_json(session, CONSUMERS_QUEUES_URL %
-                                          (protocol, host, port, URI_ENCODED))
-        for queue in queue_response:
-            if queue.get('consumers', 0) == 0 and queue.get('messages', 0) > 0:
-                queues_without_consumers += 1
-
     metrics['queues_without_consumers'] = {
         'value': queues_without_consumers,
         'unit': 'queues'
@@ -243,16 +262,22 @@ def main():
 
     protocol = 'https' if options.https else 'http'
 
-    _get_connection_metrics(session, metrics, protocol,
-                            options.host, options.port)
-    _get_overview_metrics(session, metrics, protocol,
-                          options.host, options.port)
-    _get_node_metrics(session, metrics, protocol, options.host,
-                      options.port, options.name)
-    _get_queue_metrics(session, metrics, protocol, options.host,
-                       options.port)
-    _get_consumer_metrics(session, metrics, protocol, options.host,
-                          options.port)
+    host, port = options.host, options.port
+
+    # The endpoints are independent, fetch and aggregate them concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(_get_connection_metrics, session, metrics,
+                            protocol, host, port),
+            executor.submit(_get_overview_metrics, session, metrics,
+                            protocol, host, port),
+            executor.submit(_get_node_metrics, session, metrics,
+                            protocol, host, port, options.name),
+            executor.submit(_get_queue_metrics, session, metrics,
+                            protocol, host, port)
+        ]
+        for future in futures:
+            future.result()
 
     status_ok(m_name='maas_rabbitmq')
 